@@ -0,0 +1,141 @@
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+from crypto import b58_encode, b58_decode
+from ec_point_operation import curve, add, scalar_multiply
+from modular_inverse import modular_multiplicative_inverse
+from polynomial import Polynomial
+from sign_message import verify_message
+from sign_transaction import TxIn, TxOut, transaction_digest
+from threshold_signature import ThresholdSignature
+
+# Default (group_size, threshold) matrix
+GROUPS = [(3, 2), (5, 2), (10, 4), (20, 8)]
+
+
+def measure(function, repeat: int, number: int = 1) -> dict:
+    """Returns timing of function() in milliseconds per call, over repeat runs of number calls each"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - start) * 1000 / number)
+    return {'median_ms': statistics.median(timings), 'min_ms': min(timings), 'runs': repeat * number}
+
+
+def primitive_benchmarks() -> dict:
+    """Returns {name: function} of curve, field, interpolation, hashing and encoding primitives"""
+    k = random.randrange(1, curve.n)
+    point = scalar_multiply(random.randrange(1, curve.n), curve.g)
+    other = scalar_multiply(random.randrange(1, curve.n), curve.g)
+    a = random.randrange(1, curve.n)
+    points = [(i, random.randrange(curve.n)) for i in range(1, 11)]
+    payload = bytes([0]) + random.getrandbits(256).to_bytes(32, byteorder='big')
+    encoded = b58_encode(payload)
+    inputs = [TxIn(satoshi=1000, txid=random.getrandbits(256).to_bytes(32, byteorder='big').hex(), index=i, locking_script='76a9146a176cd51593e00542b8e1958b7da2be97452d0588ac') for i in range(10)]
+    outputs = [TxOut(address='1JDZRGf5fPjGTpqLNwjHFFZnagcZbwDsxw', satoshi=800)]
+    return {
+        'scalar_multiply': lambda: scalar_multiply(k, point),
+        'scalar_multiply_g': lambda: scalar_multiply(k, curve.g),
+        'add': lambda: add(point, other),
+        'modular_multiplicative_inverse': lambda: modular_multiplicative_inverse(a, curve.n),
+        # At 0 the participant subset repeats and hits the Lagrange coefficients cache, at a random x it never does
+        'interpolate_evaluate_cached': lambda: Polynomial.interpolate_evaluate(points, 0),
+        'interpolate_evaluate_uncached': lambda: Polynomial.interpolate_evaluate(points, random.randrange(curve.n)),
+        'transaction_digest[inputs=10]': lambda: transaction_digest(inputs, outputs),
+        'b58_encode': lambda: b58_encode(payload),
+        'b58_decode': lambda: b58_decode(encoded),
+    }
+
+
+def protocol_benchmarks(group_size: int, threshold: int) -> dict:
+    """Returns {name: function} of threshold signature operations for the group"""
+    ts = ThresholdSignature(group_size, threshold)
+    a_shares, _ = ts.jvrss()
+    b_shares, _ = ts.jvrss()
+    plain = 'benchmark'
+    address, signature = ts.sign_message(plain)
+    return {
+        'jvrss': lambda: ts.jvrss(),
+        'addss': lambda: ts.addss(a_shares, b_shares),
+        'pross': lambda: ts.pross(a_shares, b_shares),
+        'invss': lambda: ts.invss(a_shares),
+        'sign_recoverable': lambda: ts.sign_recoverable(b'benchmark'),
+        'verify_message': lambda: verify_message(address, plain, signature),
+    }
+
+
+def run(groups: list, repeat: int, seed: int) -> dict:
+    """Run all the benchmarks, every benchmark starts from the same seed so the inputs are reproducible"""
+    results = {}
+    random.seed(seed)
+    for name, function in primitive_benchmarks().items():
+        random.seed(seed)
+        results[name] = measure(function, repeat, 20)
+        print(f'{name:<48} {results[name]["median_ms"]:10.4f} ms')
+    for group_size, threshold in groups:
+        random.seed(seed)
+        for name, function in protocol_benchmarks(group_size, threshold).items():
+            random.seed(seed)
+            key = f'{name}[group_size={group_size},threshold={threshold}]'
+            results[key] = measure(function, repeat)
+            print(f'{key:<48} {results[key]["median_ms"]:10.4f} ms')
+    return {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(), 'seed': seed, 'repeat': repeat},
+        'results': results,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Returns [(name, baseline_ms, current_ms, ratio), ...] of benchmarks slower than baseline by more than tolerance"""
+    regressions = []
+    print(f'{"benchmark":<48} {"baseline":>10} {"current":>10} {"ratio":>7}')
+    for name, result in report['results'].items():
+        if name not in baseline['results']:
+            continue
+        baseline_ms = baseline['results'][name]['median_ms']
+        current_ms = result['median_ms']
+        ratio = current_ms / baseline_ms if baseline_ms else float('inf')
+        flag = ' REGRESSION' if ratio > 1 + tolerance else ''
+        print(f'{name:<48} {baseline_ms:10.4f} {current_ms:10.4f} {ratio:7.2f}{flag}')
+        if flag:
+            regressions.append((name, baseline_ms, current_ms, ratio))
+    return regressions
+
+
+def parse_groups(value: str) -> list:
+    """Parse 'group_size:threshold,group_size:threshold,...'"""
+    groups = []
+    for item in value.split(','):
+        group_size, threshold = item.split(':')
+        groups.append((int(group_size), int(threshold)))
+    return groups
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark primitives and threshold signature operations')
+    parser.add_argument('--groups', type=parse_groups, default=GROUPS, help='group_size:threshold pairs, such as 5:2,10:4')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed runs of each benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the benchmark inputs')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='compare results with this JSON file written by an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='flag benchmarks slower than baseline by more than this fraction')
+    args = parser.parse_args()
+
+    report = run(args.groups, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline_report = json.load(f)
+        found = compare(report, baseline_report, args.tolerance)
+        if found:
+            print(f'{len(found)} regression(s) over {args.tolerance:.0%} tolerance')
+            sys.exit(1)
@@ -21,20 +21,28 @@ def ripemd160_sha256(payload: bytes) -> bytes:
 BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
 
 
+# Reverse lookup table, char -> digit
+BASE58_INDEX = {char: digit for digit, char in enumerate(BASE58_ALPHABET)}
+# Big integers are converted 10 base58 digits at a time, 58^10 < 2^63 so each chunk is handled with small integer arithmetic
+BASE58_CHUNK_DIGITS = 10
+BASE58_CHUNK = 58 ** BASE58_CHUNK_DIGITS
+# Two digits at a time within a chunk, BASE58_PAIRS[58 * high + low] = high digit char || low digit char
+BASE58_PAIRS = [high + low for high in BASE58_ALPHABET for low in BASE58_ALPHABET]
+
+
 def b58_encode(payload: bytes) -> str:
-    pad = 0
-    for byte in payload:
-        if byte == 0:
-            pad += 1
-        else:
-            break
-    prefix = '1' * pad
+    pad = len(payload) - len(payload.lstrip(b'\x00'))
     num = int.from_bytes(payload, 'big')
-    result = ''
+    # Least significant pair first
+    pairs = []
     while num > 0:
-        num, remaining = divmod(num, 58)
-        result = BASE58_ALPHABET[remaining] + result
-    return prefix + result
+        num, chunk = divmod(num, BASE58_CHUNK)
+        for _ in range(BASE58_CHUNK_DIGITS // 2):
+            chunk, remaining = divmod(chunk, 58 * 58)
+            pairs.append(BASE58_PAIRS[remaining])
+    pairs.reverse()
+    # The most significant digit is not zero, leading '1' are only the zero digits left by the last chunk
+    return '1' * pad + ''.join(pairs).lstrip('1')
 
 
 def b58check_encode(payload: bytes) -> str:
@@ -42,20 +50,18 @@ def b58check_encode(payload: bytes) -> str:
 
 
 def b58_decode(encoded: str) -> bytes:
-    pad = 0
-    for char in encoded:
-        if char == '1':
-            pad += 1
-        else:
-            break
+    pad = len(encoded) - len(encoded.lstrip('1'))
     prefix = b'\x00' * pad
     num = 0
     try:
-        for char in encoded:
-            num *= 58
-            num += BASE58_ALPHABET.index(char)
+        for i in range(0, len(encoded), BASE58_CHUNK_DIGITS):
+            chunk = encoded[i:i + BASE58_CHUNK_DIGITS]
+            value = 0
+            for char in chunk:
+                value = value * 58 + BASE58_INDEX[char]
+            num = num * (BASE58_CHUNK if len(chunk) == BASE58_CHUNK_DIGITS else 58 ** len(chunk)) + value
     except KeyError:
-        raise ValueError(f'Invalid base58 encoded "{encoded}"')
+        raise ValueError(f'Invalid base58 encoded "{encoded}"') from None
     # if num is 0 then (0).to_bytes will return b''
     return prefix + num.to_bytes((num.bit_length() + 7) // 8, 'big')
 
@@ -1,15 +1,56 @@
 import collections
+import sys
+import threading
 
-from modular_inverse import modular_multiplicative_inverse
+import instrumentation
+from modular_inverse import modular_multiplicative_inverse, batch_inverse
 
 EllipticCurve = collections.namedtuple('EllipticCurve', 'name p a b g n h')
 
+
+class Point(tuple):
+    """
+    Affine point (x, y) on the elliptic curve, validated once when constructed from untrusted coordinates
+    Points produced by the arithmetic in this module are trusted and never checked again
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, x: int, y: int) -> 'Point':
+        if not (0 <= x < curve.p and 0 <= y < curve.p and on_curve((x, y))):
+            raise ValueError(f'Point ({x}, {y}) is not on curve {curve.name}')
+        return tuple.__new__(cls, (x, y))
+
+    @classmethod
+    def _trusted(cls, x: int, y: int) -> 'Point':
+        """Returns the point without validation, only for coordinates known to be on the curve"""
+        return tuple.__new__(cls, (x, y))
+
+    @property
+    def x(self) -> int:
+        return self[0]
+
+    @property
+    def y(self) -> int:
+        return self[1]
+
+    def __repr__(self) -> str:
+        return tuple.__repr__(self) if self else 'INFINITY'
+
+    def __reduce__(self) -> tuple or str:
+        # Unpickled points are validated again, INFINITY unpickles to the singleton itself
+        return (Point, tuple(self)) if self else 'INFINITY'
+
+
+# The point at infinity, the identity of the group law
+INFINITY = tuple.__new__(Point, ())
+
 curve = EllipticCurve(
     name='Secp256k1',
     p=0xfffffffffffffffffffffffffffffffffffffffffffffffffffffffefffffc2f,
     a=0,
     b=7,
-    g=(0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798, 0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8),
+    g=Point._trusted(0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798, 0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8),
     n=0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141,
     h=1,
 )
@@ -17,75 +58,508 @@ curve = EllipticCurve(
 
 def on_curve(point: tuple) -> bool:
     """Returns True if the given point lies on the elliptic curve."""
-    if point is None:
-        # None represents the point at infinity.
+    if point is None or point is INFINITY:
+        # None also represents the point at infinity.
         return True
     x, y = point
     return (y * y - x * x * x - curve.a * x - curve.b) % curve.p == 0
 
 
-def negative(point: tuple) -> tuple or None:
-    """Returns -point."""
-    assert on_curve(point)
+def as_point(point: tuple) -> Point:
+    """Returns point as a Point, validating it only if it is not a Point yet, None is accepted as the point at infinity."""
+    if isinstance(point, Point):
+        return point
     if point is None:
+        return INFINITY
+    return Point(*point)
+
+
+def negative(point: tuple) -> Point:
+    """Returns -point."""
+    point = as_point(point)
+    if point is INFINITY:
         # -0 = 0
-        return None
+        return INFINITY
     x, y = point
-    result = (x, -y % curve.p)
-    assert on_curve(result)
-    return result
+    return Point._trusted(x, -y % curve.p)
 
 
-def add(p: tuple, q: tuple) -> tuple or None:
+def add(p: tuple, q: tuple) -> Point:
     """Returns the result of p + q according to the group law."""
-    assert on_curve(p)
-    assert on_curve(q)
-    if p is None:
+    p, q = as_point(p), as_point(q)
+    if p is INFINITY:
         # 0 + q = q
         return q
-    if q is None:
+    if q is INFINITY:
         # p + 0 = p
         return p
-    #
-    # p == -q
-    #
-    if p == negative(q):
-        return None
-    #
-    # p != -q
-    #
+    instrumentation.count('point_add')
     x1, y1 = p
     x2, y2 = q
-    if p == q:
+    if x1 == x2:
+        #
+        # p == -q
+        #
+        if (y1 + y2) % curve.p == 0:
+            return INFINITY
+        #
+        # p == q
+        #
         m = (3 * x1 * x1 + curve.a) * modular_multiplicative_inverse(2 * y1, curve.p)
     else:
         m = (y1 - y2) * modular_multiplicative_inverse(x1 - x2, curve.p)
     x = m * m - x1 - x2
     y = y1 + m * (x - x1)
-    result = (x % curve.p, -y % curve.p)
-    assert on_curve(result)
-    return result
+    return Point._trusted(x % curve.p, -y % curve.p)
 
 
-def scalar_multiply(k: int, point: tuple) -> tuple or None:
-    """Returns k * point computed using the double and add algorithm."""
-    assert on_curve(point)
-    if k % curve.n == 0 or point is None:
+def _to_jacobian(point: Point) -> tuple or None:
+    """Returns the Jacobian coordinates (X, Y, Z) of an affine point, where x = X / Z^2 and y = Y / Z^3, None for infinity."""
+    if point is INFINITY:
         return None
-    if k < 0:
-        # k * point = -k * (-point)
-        return scalar_multiply(-k, negative(point))
-    # Double and add
-    result = None
+    x, y = point
+    return x, y, 1
+
+
+def _from_jacobian(jacobian: tuple) -> Point:
+    """Returns the affine point of the Jacobian coordinates (X, Y, Z), costs one modular inversion."""
+    if jacobian is None:
+        return INFINITY
+    x, y, z = jacobian
+    z_inv = modular_multiplicative_inverse(z, curve.p)
+    z_inv_square = z_inv * z_inv % curve.p
+    return Point._trusted(x * z_inv_square % curve.p, y * z_inv_square * z_inv % curve.p)
+
+
+def _batch_from_jacobian(jacobians: list) -> list:
+    """Returns the affine points of all the Jacobian coordinates, costs only one modular inversion in total."""
+    z_inverses = iter(batch_inverse([jacobian[2] for jacobian in jacobians if jacobian is not None], curve.p))
+    points = []
+    for jacobian in jacobians:
+        if jacobian is None:
+            points.append(INFINITY)
+            continue
+        x, y, _ = jacobian
+        z_inv = next(z_inverses)
+        z_inv_square = z_inv * z_inv % curve.p
+        points.append(Point._trusted(x * z_inv_square % curve.p, y * z_inv_square * z_inv % curve.p))
+    return points
+
+
+def _jacobian_double(p: tuple) -> tuple or None:
+    """Returns 2 * p in Jacobian coordinates, without any modular inversion."""
+    if p is None:
+        return None
+    x1, y1, z1 = p
+    if y1 == 0:
+        return None
+    y1_square = y1 * y1 % curve.p
+    s = 4 * x1 * y1_square % curve.p
+    m = 3 * x1 * x1
+    if curve.a:
+        z1_square = z1 * z1 % curve.p
+        m += curve.a * z1_square * z1_square
+    m %= curve.p
+    x3 = (m * m - 2 * s) % curve.p
+    y3 = (m * (s - x3) - 8 * y1_square * y1_square) % curve.p
+    z3 = 2 * y1 * z1 % curve.p
+    return x3, y3, z3
+
+
+def _jacobian_add_affine(p: tuple, q: Point) -> tuple or None:
+    """Returns p + q where p is in Jacobian coordinates and q is an affine point (mixed addition)."""
+    if q is INFINITY:
+        return p
+    if p is None:
+        return _to_jacobian(q)
+    x1, y1, z1 = p
+    x2, y2 = q
+    z1_square = z1 * z1 % curve.p
+    u2 = x2 * z1_square % curve.p
+    s2 = y2 * z1_square * z1 % curve.p
+    h = (u2 - x1) % curve.p
+    r = (s2 - y1) % curve.p
+    if h == 0:
+        # p == q or p == -q
+        return _jacobian_double(p) if r == 0 else None
+    h_square = h * h % curve.p
+    h_cube = h * h_square % curve.p
+    v = x1 * h_square % curve.p
+    x3 = (r * r - h_cube - 2 * v) % curve.p
+    y3 = (r * (v - x3) - y1 * h_cube) % curve.p
+    z3 = z1 * h % curve.p
+    return x3, y3, z3
+
+
+def _jacobian_add(p: tuple, q: tuple) -> tuple or None:
+    """Returns p + q where both p and q are in Jacobian coordinates."""
+    if p is None:
+        return q
+    if q is None:
+        return p
+    x1, y1, z1 = p
+    x2, y2, z2 = q
+    z1_square = z1 * z1 % curve.p
+    z2_square = z2 * z2 % curve.p
+    u1 = x1 * z2_square % curve.p
+    u2 = x2 * z1_square % curve.p
+    s1 = y1 * z2_square * z2 % curve.p
+    s2 = y2 * z1_square * z1 % curve.p
+    h = (u2 - u1) % curve.p
+    r = (s2 - s1) % curve.p
+    if h == 0:
+        # p == q or p == -q
+        return _jacobian_double(p) if r == 0 else None
+    h_square = h * h % curve.p
+    h_cube = h * h_square % curve.p
+    v = u1 * h_square % curve.p
+    x3 = (r * r - h_cube - 2 * v) % curve.p
+    y3 = (r * (v - x3) - s1 * h_cube) % curve.p
+    z3 = z1 * z2 * h % curve.p
+    return x3, y3, z3
+
+
+def _jacobian_negative(p: tuple) -> tuple or None:
+    """Returns -p in Jacobian coordinates."""
+    if p is None:
+        return None
+    x, y, z = p
+    return x, -y % curve.p, z
+
+
+# Fixed-base window width in bits for multiplications by curve.g and by points with cached tables
+G_WINDOW_BITS = 4
+# Lazily built table, _g_table[i][j - 1] = j * 2^(G_WINDOW_BITS * i) * G in affine coordinates
+_g_table = None
+
+
+def _build_fixed_base_table(point: Point) -> list:
+    """Returns table[i][j - 1] = j * 2^(G_WINDOW_BITS * i) * point in affine coordinates"""
+    row_size = (1 << G_WINDOW_BITS) - 1
+    multiples = []
+    base = _to_jacobian(point)
+    for _ in range((curve.n.bit_length() + G_WINDOW_BITS - 1) // G_WINDOW_BITS):
+        multiple = base
+        multiples.append(multiple)
+        for _ in range(row_size - 1):
+            multiple = _jacobian_add(multiple, base)
+            multiples.append(multiple)
+        # base = 2^G_WINDOW_BITS * base
+        for _ in range(G_WINDOW_BITS):
+            base = _jacobian_double(base)
+        instrumentation.count('point_add', row_size - 1)
+        instrumentation.count('point_double', G_WINDOW_BITS)
+    # Normalize the whole table to affine coordinates with one inversion
+    points = _batch_from_jacobian(multiples)
+    return [points[i:i + row_size] for i in range(0, len(points), row_size)]
+
+
+def _fixed_base_table() -> list:
+    """Returns the precomputed multiples of the generator, building them once per process on first use."""
+    global _g_table
+    if _g_table is None:
+        _g_table = _build_fixed_base_table(curve.g)
+    return _g_table
+
+
+def _fixed_base_accumulate(result: tuple, k: int, table: list) -> tuple or None:
+    """Returns result + k * point in Jacobian coordinates, 0 < k < n, with one mixed addition per non-zero window of k and no doublings."""
+    mask = (1 << G_WINDOW_BITS) - 1
+    i = 0
+    additions = 0
+    while k:
+        digit = k & mask
+        if digit:
+            result = _jacobian_add_affine(result, table[i][digit - 1])
+            additions += 1
+        k >>= G_WINDOW_BITS
+        i += 1
+    instrumentation.count('point_add', additions)
+    return result
+
+
+def _fixed_base_multiply(k: int) -> Point:
+    """Returns k * G, 0 < k < n, with one mixed addition per non-zero window and no doublings."""
+    return _from_jacobian(_fixed_base_accumulate(None, k, _fixed_base_table()))
+
+
+# Memory budget in bytes of the fixed-base tables cached for variable points
+PRECOMPUTED_TABLES_BUDGET = 64 << 20
+# Uses of a point before its table is built, building one costs about as much as 4 scalar multiplications
+PRECOMPUTED_TABLES_ADMIT_AFTER = 4
+# Maximum number of points whose uses are counted while waiting for admission
+PRECOMPUTED_TABLES_CANDIDATES = 1 << 16
+
+PrecomputedTablesInfo = collections.namedtuple('PrecomputedTablesInfo', 'hits misses tables bytes budget')
+
+
+class PrecomputedTables:
+    """
+    LRU cache of fixed-base tables of hot variable points, such as public keys whose signatures are verified again and again
+    A table is built once a point has been used admit_after times, least recently used tables are evicted to stay within budget bytes
+    """
+
+    def __init__(self, budget: int = PRECOMPUTED_TABLES_BUDGET, admit_after: int = PRECOMPUTED_TABLES_ADMIT_AFTER) -> None:
+        self.budget = budget
+        self.admit_after = admit_after
+        self.hits = 0
+        self.misses = 0
+        self._tables = collections.OrderedDict()
+        self._uses = collections.OrderedDict()
+        # Estimated size in bytes of one table
+        self._table_bytes = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tables)
+
+    @staticmethod
+    def _measure(table: list) -> int:
+        size = sys.getsizeof(table)
+        for row in table:
+            size += sys.getsizeof(row) + sum(sys.getsizeof(point) + sys.getsizeof(point.x) + sys.getsizeof(point.y) for point in row)
+        return size
+
+    def get(self, point: Point) -> list or None:
+        """Returns the fixed-base table of the point, None until the point is used often enough to build one"""
+        with self._lock:
+            table = self._tables.get(point)
+            if table is not None:
+                self._tables.move_to_end(point)
+                self.hits += 1
+                return table
+            self.misses += 1
+            if self._table_bytes is None:
+                # Every table has the same shape as the one of G
+                self._table_bytes = PrecomputedTables._measure(_fixed_base_table())
+            uses = self._uses.pop(point, 0) + 1
+            if uses < self.admit_after or self._table_bytes > self.budget:
+                self._uses[point] = uses
+                if len(self._uses) > PRECOMPUTED_TABLES_CANDIDATES:
+                    self._uses.popitem(last=False)
+                return None
+        table = _build_fixed_base_table(point)
+        with self._lock:
+            self._tables[point] = table
+            while len(self._tables) * self._table_bytes > self.budget:
+                self._tables.popitem(last=False)
+        return table
+
+    def info(self) -> PrecomputedTablesInfo:
+        """Returns (hits, misses, tables, bytes, budget) of the cache"""
+        return PrecomputedTablesInfo(self.hits, self.misses, len(self._tables), len(self._tables) * (self._table_bytes or 0), self.budget)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tables.clear()
+            self._uses.clear()
+            self.hits = self.misses = 0
+
+
+# Process-wide cache used by multi_scalar_multiply(..., precomputed=True)
+precomputed_tables = PrecomputedTables()
+
+
+def scalar_multiply(k: int, point: tuple) -> Point:
+    """Returns k * point, with the fixed-base table for G, else with wNAF on the GLV split k1 * point + k2 * (lambda * point) in Jacobian coordinates."""
+    instrumentation.count('scalar_multiply')
+    point = as_point(point)
+    if k % curve.n == 0 or point is INFINITY:
+        return INFINITY
+    # k * point = (k mod n) * point, which also covers negative k
+    k %= curve.n
+    if point == curve.g:
+        return _fixed_base_multiply(k)
+    return _from_jacobian(_strauss_multiply([(k, point)]))
+
+
+# wNAF window width in bits for multi scalar multiplication
+MULTI_WINDOW_BITS = 5
+# Lazily built odd multiples [G, 3G, 5G, ...] in affine coordinates
+_g_odd_multiples = None
+
+
+def _wnaf(k: int, width: int) -> list:
+    """Returns the width-w non-adjacent form of k > 0, least significant digit first, every non-zero digit is odd."""
+    digits = []
     while k:
         if k & 1:
-            result = add(result, point)
-        point = add(point, point)
+            digit = k & ((1 << width) - 1)
+            if digit >= 1 << (width - 1):
+                digit -= 1 << width
+            k -= digit
+        else:
+            digit = 0
+        digits.append(digit)
         k >>= 1
-    assert on_curve(result)
+    return digits
+
+
+def _odd_multiples(point: tuple, width: int) -> list:
+    """Returns [P, 3P, 5P, ..., (2^(w-1) - 1)P] in Jacobian coordinates."""
+    multiple = _to_jacobian(point)
+    twice = _jacobian_double(multiple)
+    multiples = [multiple]
+    for _ in range((1 << (width - 2)) - 1):
+        multiple = _jacobian_add(multiple, twice)
+        multiples.append(multiple)
+    instrumentation.count('point_double')
+    instrumentation.count('point_add', len(multiples) - 1)
+    return multiples
+
+
+def _g_odd_multiples_table() -> list:
+    """Returns the odd multiples of the generator in affine coordinates, building them once per process on first use."""
+    global _g_odd_multiples
+    if _g_odd_multiples is None:
+        _g_odd_multiples = _batch_from_jacobian(_odd_multiples(curve.g, MULTI_WINDOW_BITS))
+    return _g_odd_multiples
+
+
+# GLV endomorphism of Secp256k1, lambda * (x, y) = (beta * x, y) where beta^3 = 1 mod p and lambda^3 = 1 mod n
+GLV_BETA = 0x7ae96a2b657c07106e64479eac3434e99cf0497512f58995c1396c28719501ee
+GLV_LAMBDA = 0x5363ad4cc05c30e0a5261c028812645a122e22ea20816678df02967c1b23bd72
+# Short basis (a1, b1), (a2, b2) of the lattice {(x, y) | x + y * lambda = 0 mod n}
+GLV_A1 = 0x3086d221a7d46bcde86c90e49284eb15
+GLV_B1 = -0xe4437ed6010e88286f547fa90abfe4c3
+GLV_A2 = 0x114ca50f7a8e2f3f657c1108d9d44cfd8
+GLV_B2 = GLV_A1
+
+
+def _glv_split(k: int) -> tuple:
+    """Returns (k1, k2) with k = k1 + k2 * lambda mod n, both about 128 bits and possibly negative, 0 <= k < n"""
+    # Round k * (b2, -b1) / n to the closest lattice point, then k1, k2 are what is left
+    c1 = (GLV_B2 * k + curve.n // 2) // curve.n
+    c2 = (-GLV_B1 * k + curve.n // 2) // curve.n
+    k1 = k - c1 * GLV_A1 - c2 * GLV_A2
+    k2 = -c1 * GLV_B1 - c2 * GLV_B2
+    return k1, k2
+
+
+def _endomorphism(point: Point) -> Point:
+    """Returns lambda * point, costs one field multiplication"""
+    x, y = point
+    return Point._trusted(GLV_BETA * x % curve.p, y)
+
+
+def _strauss_multiply(terms: list) -> tuple or None:
+    """
+    Returns the sum of k * P for terms [(k, P), ...], 0 < k < n, with interleaved wNAF (Strauss-Shamir)
+    Every k * P is split into k1 * P + k2 * (lambda * P) by the GLV endomorphism, so the chain of doublings is only about 128 long
+    """
+    # Odd multiples of all the points other than G, normalized to affine coordinates together with one inversion
+    table_size = 1 << (MULTI_WINDOW_BITS - 2)
+    jacobians = []
+    for _, point in terms:
+        if point != curve.g:
+            jacobians.extend(_odd_multiples(point, MULTI_WINDOW_BITS))
+    affines = _batch_from_jacobian(jacobians) if jacobians else []
+    recoded = []
+    offset = 0
+    for k, point in terms:
+        if point == curve.g:
+            multiples = _g_odd_multiples_table()
+        else:
+            multiples = affines[offset:offset + table_size]
+            offset += table_size
+        k1, k2 = _glv_split(k)
+        # Odd multiples of lambda * P are those of P mapped by the endomorphism
+        for scalar, table in ((k1, multiples), (k2, [_endomorphism(m) for m in multiples])):
+            negatives = [negative(m) for m in table]
+            if scalar < 0:
+                scalar, table, negatives = -scalar, negatives, table
+            if scalar:
+                recoded.append((_wnaf(scalar, MULTI_WINDOW_BITS), table, negatives))
+    result = None
+    length = max(len(term[0]) for term in recoded)
+    if instrumentation.enabled():
+        instrumentation.count('point_double', length)
+        instrumentation.count('point_add', sum(len(digits) - digits.count(0) for digits, _, _ in recoded))
+    for i in range(length - 1, -1, -1):
+        result = _jacobian_double(result)
+        for digits, multiples, negatives in recoded:
+            if i < len(digits) and digits[i]:
+                digit = digits[i]
+                if digit > 0:
+                    result = _jacobian_add_affine(result, multiples[digit >> 1])
+                else:
+                    result = _jacobian_add_affine(result, negatives[-digit >> 1])
     return result
 
 
+def _pippenger_window_bits(count: int) -> int:
+    """Returns the bucket window width c minimizing (256 / c) * (count + 2^(c + 1)) point additions"""
+    bits = curve.n.bit_length()
+    return min(range(1, 17), key=lambda c: ((bits + c - 1) // c) * (count + (1 << (c + 1))))
+
+
+def _pippenger_multiply(terms: list) -> tuple or None:
+    """Returns the sum of k * P for terms [(k, P), ...], 0 < k < n, with the bucket method (Pippenger)"""
+    width = _pippenger_window_bits(len(terms))
+    mask = (1 << width) - 1
+    windows = (curve.n.bit_length() + width - 1) // width
+    if instrumentation.enabled():
+        # Per window, one addition per non-zero digit, 2 * 2^c for the running sums and 1 into the result
+        digits = sum(1 for k, _ in terms for shift in range(0, windows * width, width) if (k >> shift) & mask)
+        instrumentation.count('point_double', windows * width)
+        instrumentation.count('point_add', digits + windows * (2 * mask + 1))
+    result = None
+    for shift in range((windows - 1) * width, -1, -width):
+        for _ in range(width):
+            result = _jacobian_double(result)
+        # buckets[d - 1] = sum of all the points whose window digit is d
+        buckets = [None] * mask
+        for k, point in terms:
+            digit = (k >> shift) & mask
+            if digit:
+                buckets[digit - 1] = _jacobian_add_affine(buckets[digit - 1], point)
+        # sum(d * buckets[d - 1]) with running sums, 2 * 2^c additions
+        running, window_sum = None, None
+        for bucket in reversed(buckets):
+            running = _jacobian_add(running, bucket)
+            window_sum = _jacobian_add(window_sum, running)
+        result = _jacobian_add(result, window_sum)
+    return result
+
+
+# Number of terms from which multi_scalar_multiply switches from Strauss-Shamir to Pippenger
+PIPPENGER_THRESHOLD = 80
+
+
+def multi_scalar_multiply(pairs: list, precomputed: bool = False) -> Point:
+    """
+    Returns k1 * P1 + k2 * P2 + ... for pairs [(k1, P1), (k2, P2), ...]
+    All the terms share one chain of doublings, with interleaved wNAF for a few terms or the bucket method for many
+    If precomputed, points other than G are looked up in precomputed_tables, terms with tables need no doublings at all
+    """
+    instrumentation.count('multi_scalar_multiply')
+    terms = []
+    for k, point in pairs:
+        point = as_point(point)
+        k %= curve.n
+        if k == 0 or point is INFINITY:
+            continue
+        terms.append((k, point))
+    result = None
+    if precomputed:
+        rest = []
+        for k, point in terms:
+            table = precomputed_tables.get(point) if point != curve.g else None
+            if table is None:
+                rest.append((k, point))
+            else:
+                result = _fixed_base_accumulate(result, k, table)
+        # G is cheaper on the shared doublings, unless no doubling is left at all
+        if result is not None and len(rest) == 1 and rest[0][1] == curve.g:
+            return _from_jacobian(_fixed_base_accumulate(result, rest[0][0], _fixed_base_table()))
+        terms = rest
+    if not terms:
+        return _from_jacobian(result)
+    if len(terms) >= PIPPENGER_THRESHOLD:
+        return _from_jacobian(_jacobian_add(result, _pippenger_multiply(terms)))
+    return _from_jacobian(_jacobian_add(result, _strauss_multiply(terms)))
+
+
 if __name__ == '__main__':
     a = 0xf97c89aaacf0cd2e47ddbacc97dae1f88bec49106ac37716c451dcdd008a4b62
     print('a =', hex(a))
@@ -97,3 +571,40 @@ if __name__ == '__main__':
 
     print(private_key_to_wif(a))
     print(public_key_to_address(ag))
+
+    # Benchmark against the affine double and add, which costs one modular inversion per point operation
+    import timeit
+
+    def affine_scalar_multiply(k: int, point: tuple) -> Point:
+        result = INFINITY
+        while k:
+            if k & 1:
+                result = add(result, point)
+            point = add(point, point)
+            k >>= 1
+        return result
+
+    assert affine_scalar_multiply(a, curve.g) == ag
+    assert affine_scalar_multiply(a, ag) == scalar_multiply(a, ag)
+    # Cross-check the GLV paths against the affine double and add, over random scalars and edge cases
+    import random
+
+    assert pow(GLV_BETA, 3, curve.p) == 1 and pow(GLV_LAMBDA, 3, curve.n) == 1
+    assert affine_scalar_multiply(GLV_LAMBDA, ag) == _endomorphism(ag)
+    edge_cases = [0, 1, 2, curve.n - 1, curve.n, curve.n + 1, -1, -a, GLV_LAMBDA, GLV_A1, 1 << 128, (1 << 256) - 1]
+    for k in edge_cases + [random.randrange(-curve.n, 2 * curve.n) for _ in range(50)]:
+        k1, k2 = _glv_split(k % curve.n)
+        assert (k1 + k2 * GLV_LAMBDA - k) % curve.n == 0 and max(abs(k1), abs(k2)).bit_length() <= 129
+        expected = affine_scalar_multiply(k % curve.n, ag)
+        assert scalar_multiply(k, ag) == expected, k
+        assert scalar_multiply(k, curve.g) == affine_scalar_multiply(k % curve.n, curve.g), k
+        j = random.randrange(curve.n)
+        assert multi_scalar_multiply([(k, ag), (j, curve.g)]) == add(expected, affine_scalar_multiply(j, curve.g)), k
+    rounds = 20
+    affine_time = timeit.timeit(lambda: affine_scalar_multiply(a, ag), number=rounds) / rounds
+    jacobian_time = timeit.timeit(lambda: scalar_multiply(a, ag), number=rounds) / rounds
+    print(f'affine   scalar_multiply {affine_time * 1000:.3f} ms/call')
+    print(f'jacobian scalar_multiply {jacobian_time * 1000:.3f} ms/call')
+    print(f'speedup x{affine_time / jacobian_time:.2f}')
+    fixed_base_time = timeit.timeit(lambda: scalar_multiply(a, curve.g), number=rounds) / rounds
+    print(f'fixed-base scalar_multiply(k, G) {fixed_base_time * 1000:.3f} ms/call')
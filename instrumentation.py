@@ -0,0 +1,138 @@
+import collections
+import contextlib
+import functools
+import time
+
+# A finished span, counts holds the operations counted between entering and leaving it
+#   name        qualified name of the traced function or the name given to span()
+#   depth       nesting level, 0 for the outermost span of the recording
+#   seconds     wall time spent inside the span
+Span = collections.namedtuple('Span', 'name depth seconds counts')
+
+# Active recording, None while instrumentation is disabled
+_recording = None
+
+
+class Recording:
+    """
+    Operation counters and finished spans collected by recording()
+    Recording is process-wide, operations run by other threads (such as the presignature worker) are counted too,
+    while those run in the worker processes of an executor are not
+    """
+
+    def __init__(self, callback=None) -> None:
+        self.counts = collections.Counter()
+        # Spans in the order they started, None for those still running
+        self.spans = []
+        # Called with every finished Span
+        self.callback = callback
+        self._depth = 0
+
+    def __repr__(self) -> str:
+        return f'<Recording counts={dict(self.counts)}, spans={len(self.spans)}>'
+
+
+class _SpanContext:
+    """Context manager timing a span and counting the operations inside it"""
+
+    __slots__ = ('recording', 'name', 'depth', 'index', 'start', 'start_counts')
+
+    def __init__(self, recording: Recording, name: str) -> None:
+        self.recording = recording
+        self.name = name
+
+    def __enter__(self) -> '_SpanContext':
+        self.depth = self.recording._depth
+        self.recording._depth += 1
+        # Reserve the slot so that recording.spans stays in the order spans started
+        self.index = len(self.recording.spans)
+        self.recording.spans.append(None)
+        self.start_counts = self.recording.counts.copy()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        seconds = time.perf_counter() - self.start
+        self.recording._depth -= 1
+        counts = self.recording.counts.copy()
+        counts.subtract(self.start_counts)
+        span = Span(self.name, self.depth, seconds, +counts)
+        self.recording.spans[self.index] = span
+        if self.recording.callback is not None:
+            self.recording.callback(span)
+
+
+def enabled() -> bool:
+    """Returns True while a recording is active, guard any work done only to compute counts with it"""
+    return _recording is not None
+
+
+def count(name: str, n: int = 1) -> None:
+    """Add n to the counter of the operation, does nothing while instrumentation is disabled"""
+    if _recording is not None:
+        _recording.counts[name] += n
+
+
+@contextlib.contextmanager
+def recording(callback=None) -> Recording:
+    """
+    Enable instrumentation inside the with block, yields the Recording
+    callback, if given, is called with every Span as it finishes
+    """
+    global _recording
+    previous, _recording = _recording, Recording(callback)
+    try:
+        yield _recording
+    finally:
+        _recording = previous
+
+
+def span(name: str):
+    """Returns a context manager recording a Span of the with block, a shared no-op one while instrumentation is disabled"""
+    if _recording is None:
+        return contextlib.nullcontext()
+    return _SpanContext(_recording, name)
+
+
+def traced(function):
+    """Decorator recording a Span of every call while instrumentation is enabled"""
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _recording is None:
+            return function(*args, **kwargs)
+        with _SpanContext(_recording, name):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def report(recording: Recording) -> str:
+    """Returns the spans as an indented tree, followed by the total counts"""
+    lines = []
+    for span in recording.spans:
+        if span is None:
+            # Still running
+            continue
+        counts = ', '.join(f'{name}={n}' for name, n in sorted(span.counts.items()))
+        lines.append(f'{"  " * span.depth}{span.name} {span.seconds * 1000:.3f} ms {counts}')
+    lines.append('total ' + ', '.join(f'{name}={n}' for name, n in sorted(recording.counts.items())))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    # Record through the imported module, this script runs as __main__ which is a different module object
+    import instrumentation
+    from threshold_signature import ThresholdSignature
+
+    ts = ThresholdSignature(group_size=5, threshold=2)
+    with instrumentation.recording() as r:
+        ts.sign_message('instrumented')
+    print(instrumentation.report(r))
+    print('------------------')
+    # Spans streamed to a callback as they finish
+    with instrumentation.recording(callback=lambda s: print(f'{s.name} {s.seconds * 1000:.3f} ms {dict(s.counts)}')):
+        with instrumentation.span('invss of the key shares'):
+            ts.invss(ts.shares)
+    assert not instrumentation.enabled()
@@ -0,0 +1,261 @@
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from concurrent.futures import Executor
+
+from crypto import sha256
+from ec_point_operation import Point
+from meta import serialize_public_key
+from presignature import Presignature
+from share_vector import ShareVector, SHARE_BYTES
+from threshold_signature import ThresholdSignature
+
+# Keystore file layout, all integers are big-endian
+#   header          magic || version || reserved || group count || index slot count
+#   index           slot count slots of (group id || record offset), open addressing with linear probing, offset 0 for empty
+#   records         one per group, in the order they were saved
+# Group record
+#   record header   group id || group size || threshold || verifiable || reserved || presignature count
+#   public key      x || y
+#   shares          group size * 32-byte shares of players 1, 2, ..., group size
+#   presignatures   presignature count * (r || recovery id || used || ids of the 2t + 1 picked players || group size * 32-byte shares of k^-1)
+MAGIC = b'TSKS'
+VERSION = 1
+HEADER = struct.Struct('>4sHHQQ')
+INDEX_SLOT = struct.Struct('>32sQ')
+RECORD_HEADER = struct.Struct('>32sHHB3xI')
+PRESIGNATURE_HEADER = struct.Struct('>32sBB')
+PLAYER_ID = struct.Struct('>H')
+GROUP_ID_BYTES = 32
+PUBLIC_KEY_BYTES = 64
+
+
+def group_id(public_key: tuple) -> bytes:
+    """Returns the default 32-byte id of a group, sha256 of its compressed public key"""
+    return sha256(serialize_public_key(public_key))
+
+
+def _presignature_bytes(group_size: int, threshold: int) -> int:
+    return PRESIGNATURE_HEADER.size + (2 * threshold - 1) * PLAYER_ID.size + group_size * SHARE_BYTES
+
+
+def _slot_count(group_count: int) -> int:
+    """Returns the power of 2 keeping the index at most half full"""
+    slots = 1
+    while slots < 2 * group_count:
+        slots <<= 1
+    return slots
+
+
+def _slot(identifier: bytes, slot_count: int) -> int:
+    return int.from_bytes(identifier[:8], byteorder='big') & (slot_count - 1)
+
+
+def save_keystore(path: str, groups: dict) -> None:
+    """
+    Write groups {group_id: ThresholdSignature} to the keystore file at path
+    Stored presignatures of the groups are moved to the keystore, so that each of them is still used only once
+    The file is written next to path and then renamed over it, so a failed save never leaves a truncated keystore
+    """
+    slot_count = _slot_count(len(groups))
+    offset = HEADER.size + slot_count * INDEX_SLOT.size
+    index = [(bytes(GROUP_ID_BYTES), 0)] * slot_count
+    records = []
+    for identifier, ts in groups.items():
+        if len(identifier) != GROUP_ID_BYTES:
+            raise ValueError(f'Group id should be {GROUP_ID_BYTES} bytes')
+        slot = _slot(identifier, slot_count)
+        while index[slot][1]:
+            if index[slot][0] == identifier:
+                raise ValueError(f'Duplicate group id {identifier.hex()}')
+            slot = (slot + 1) & (slot_count - 1)
+        index[slot] = (identifier, offset)
+        presignatures = list(ts.presignatures)
+        ts.presignatures.clear()
+        records.append((identifier, ts, presignatures))
+        threshold = ts.polynomial_order + 1
+        offset += RECORD_HEADER.size + PUBLIC_KEY_BYTES + ts.group_size * SHARE_BYTES + len(presignatures) * _presignature_bytes(ts.group_size, threshold)
+    fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            _write_keystore(f, slot_count, index, records)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _write_keystore(f, slot_count: int, index: list, records: list) -> None:
+    """Write the header, index and group records of a keystore to the file object f"""
+    f.write(HEADER.pack(MAGIC, VERSION, 0, len(records), slot_count))
+    f.write(b''.join(INDEX_SLOT.pack(identifier, record_offset) for identifier, record_offset in index))
+    for identifier, ts, presignatures in records:
+        threshold = ts.polynomial_order + 1
+        x, y = ts.public_key
+        parts = [
+            RECORD_HEADER.pack(identifier, ts.group_size, threshold, ts.verifiable, len(presignatures)),
+            x.to_bytes(32, byteorder='big') + y.to_bytes(32, byteorder='big'),
+            ts.shares.to_bytes(),
+        ]
+        for presignature in presignatures:
+            parts.append(PRESIGNATURE_HEADER.pack(presignature.r.to_bytes(32, byteorder='big'), presignature.recovery_id, 0))
+            parts.extend(PLAYER_ID.pack(player_id) for player_id in presignature.ids)
+            parts.append(presignature.mod_inv_k_shares.to_bytes())
+        f.write(b''.join(parts))
+
+
+class Keystore:
+    """
+    Keystore file mapped into memory, a group is found through the index and only its record is read
+    Open with writable=True to take presignatures, which are then marked used in the file
+    Taking presignatures holds an exclusive lock on the file, so processes sharing the keystore never take the same one
+    """
+
+    def __init__(self, path: str, writable: bool = False) -> None:
+        self.writable = writable
+        # flock excludes other open handles of the file, this excludes threads sharing the handle
+        self._lock = threading.Lock()
+        self._file = open(path, 'r+b' if writable else 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f'Empty keystore file {path}') from None
+        if len(self._map) < HEADER.size:
+            self.close()
+            raise ValueError(f'Truncated keystore file {path}')
+        magic, version, _, self.group_count, self.slot_count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{path} is not a version {VERSION} keystore')
+
+    def __enter__(self) -> 'Keystore':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.group_count
+
+    def __contains__(self, identifier: bytes) -> bool:
+        return self._find(identifier) is not None
+
+    def _find(self, identifier: bytes) -> int or None:
+        """Returns the record offset of the group, None if it is not in the keystore"""
+        slot = _slot(identifier, self.slot_count)
+        for _ in range(self.slot_count):
+            slot_identifier, offset = INDEX_SLOT.unpack_from(self._map, HEADER.size + slot * INDEX_SLOT.size)
+            if offset == 0:
+                return None
+            if slot_identifier == identifier:
+                return offset
+            slot = (slot + 1) & (self.slot_count - 1)
+        return None
+
+    def group_ids(self) -> list:
+        """Returns ids of all the groups, reading the whole index"""
+        ids = []
+        for slot in range(self.slot_count):
+            identifier, offset = INDEX_SLOT.unpack_from(self._map, HEADER.size + slot * INDEX_SLOT.size)
+            if offset:
+                ids.append(identifier)
+        return ids
+
+    def load(self, identifier: bytes, executor: Executor = None, take_presignatures: bool = False) -> ThresholdSignature:
+        """
+        Returns the ThresholdSignature of the group without generating keys again, raises KeyError if the group is not in the keystore
+        If take_presignatures, the unused presignatures are handed to the group and marked used in the file
+        """
+        offset = self._find(identifier)
+        if offset is None:
+            raise KeyError(identifier.hex())
+        view = memoryview(self._map)
+        try:
+            _, group_size, threshold, verifiable, presignature_count = RECORD_HEADER.unpack_from(view, offset)
+            offset += RECORD_HEADER.size
+            public_key = Point(int.from_bytes(view[offset:offset + 32], byteorder='big'), int.from_bytes(view[offset + 32:offset + 64], byteorder='big'))
+            offset += PUBLIC_KEY_BYTES
+            shares = ShareVector.from_bytes(view[offset:offset + group_size * SHARE_BYTES])
+            offset += group_size * SHARE_BYTES
+            ts = ThresholdSignature(group_size, threshold, bool(verifiable), executor, shares, public_key)
+            if take_presignatures:
+                if not self.writable:
+                    raise ValueError('Keystore should be opened writable to take presignatures')
+                # Checking and setting the used flags must not interleave with another taker, or the same nonce signs twice
+                with self._lock:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+                    try:
+                        for _ in range(presignature_count):
+                            presignature, used = self._read_presignature(view, offset, group_size, threshold)
+                            if not used:
+                                ts.presignatures.append(presignature)
+                                # Mark used before handing out, a presignature must never sign twice
+                                view[offset + PRESIGNATURE_HEADER.size - 1] = 1
+                            offset += _presignature_bytes(group_size, threshold)
+                        self._map.flush()
+                    finally:
+                        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            return ts
+        finally:
+            view.release()
+
+    @staticmethod
+    def _read_presignature(view: memoryview, offset: int, group_size: int, threshold: int) -> tuple:
+        """Returns (presignature, used) of the presignature record at offset"""
+        r, recovery_id, used = PRESIGNATURE_HEADER.unpack_from(view, offset)
+        offset += PRESIGNATURE_HEADER.size
+        ids = [PLAYER_ID.unpack_from(view, offset + i * PLAYER_ID.size)[0] for i in range(2 * threshold - 1)]
+        offset += len(ids) * PLAYER_ID.size
+        mod_inv_k_shares = ShareVector.from_bytes(view[offset:offset + group_size * SHARE_BYTES])
+        return Presignature(int.from_bytes(r, byteorder='big'), recovery_id, mod_inv_k_shares, ids), bool(used)
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+
+if __name__ == '__main__':
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from sign_message import verify_message
+
+    groups = {}
+    for _ in range(200):
+        ts = ThresholdSignature(group_size=5, threshold=2)
+        groups[group_id(ts.public_key)] = ts
+    wallet_id, wallet = next(iter(groups.items()))
+    wallet.presignatures.extend(wallet.presign_many(4))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'groups.tsks')
+        save_keystore(path, groups)
+        print(f'{len(groups)} groups, {os.path.getsize(path)} bytes')
+        with Keystore(path, writable=True) as keystore:
+            start = time.perf_counter()
+            loaded = keystore.load(wallet_id, take_presignatures=True)
+            print(f'load {(time.perf_counter() - start) * 1000:.3f} ms')
+            assert loaded.shares == wallet.shares and loaded.public_key == wallet.public_key
+            assert len(loaded.presignatures) == 4 and wallet_id in keystore and len(keystore) == 200
+            address, signature = loaded.sign_message('Loaded from keystore')
+            print(address, signature, verify_message(address, 'Loaded from keystore', signature))
+            # Presignatures are taken only once
+            assert len(keystore.load(wallet_id, take_presignatures=True).presignatures) == 0
+            assert sorted(keystore.group_ids()) == sorted(groups)
+            assert bytes(32) not in keystore
+        # Two handles, as two processes would have, taking the presignatures of one group at once
+        wallet.presignatures.extend(wallet.presign_many(8))
+        save_keystore(path, groups)
+        handles = [Keystore(path, writable=True) for _ in range(2)]
+        with ThreadPoolExecutor(2) as pool:
+            taken = list(pool.map(lambda keystore: keystore.load(wallet_id, take_presignatures=True).presignatures, handles))
+        for keystore in handles:
+            keystore.close()
+        nonces = [presignature.r for presignatures in taken for presignature in presignatures]
+        print('taken by each handle', [len(presignatures) for presignatures in taken])
+        assert len(nonces) == len(set(nonces)) == 8
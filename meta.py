@@ -1,7 +1,11 @@
+import functools
 from binascii import hexlify
+from collections import deque
+from concurrent.futures import Executor
+from itertools import islice
 
 from crypto import ripemd160_sha256, b58check_encode, b58check_decode, sha256, b58_encode
-from ec_point_operation import curve
+from ec_point_operation import curve, Point
 
 
 def int_to_varint(value: int) -> bytes:
@@ -15,6 +19,20 @@ def int_to_varint(value: int) -> bytes:
         return b'\xff' + value.to_bytes(8, 'little')
 
 
+def varint_to_int(buffer, offset: int = 0) -> tuple:
+    """Returns (value, offset after the varint) of the varint in buffer at offset"""
+    if offset >= len(buffer):
+        raise ValueError(f'Truncated varint at offset {offset}')
+    prefix = buffer[offset]
+    if prefix <= 0xfc:
+        return prefix, offset + 1
+    width = {0xfd: 2, 0xfe: 4, 0xff: 8}[prefix]
+    end = offset + 1 + width
+    if end > len(buffer):
+        raise ValueError(f'Truncated varint at offset {offset}')
+    return int.from_bytes(buffer[offset + 1:end], 'little'), end
+
+
 def serialize_public_key(public_key: tuple, compressed: bool = True) -> bytes:
     """Serialize public key point to compressed format (02 || x) or (03 || x), or uncompressed format (04 || x || y)"""
     x, y = public_key
@@ -23,13 +41,32 @@ def serialize_public_key(public_key: tuple, compressed: bool = True) -> bytes:
     return b'\x04' + x.to_bytes(32, byteorder='big') + y.to_bytes(32, byteorder='big')
 
 
+def deserialize_public_key(serialized: bytes) -> Point:
+    """Deserialize public key from compressed format (02 || x) or (03 || x), or uncompressed format (04 || x || y), the point is validated here"""
+    if len(serialized) == 33 and serialized[0] in (2, 3):
+        x = int.from_bytes(serialized[1:], byteorder='big')
+        y_squared = (x * x * x + curve.a * x + curve.b) % curve.p
+        y = pow(y_squared, (curve.p + 1) // 4, curve.p)
+        if y % 2 != serialized[0] % 2:
+            y = -y % curve.p
+        return Point(x, y)
+    if len(serialized) == 65 and serialized[0] == 4:
+        return Point(int.from_bytes(serialized[1:33], byteorder='big'), int.from_bytes(serialized[33:], byteorder='big'))
+    raise ValueError(f'Invalid serialized public key {hexlify(serialized)}')
+
+
 def public_key_hash(public_key: tuple, compressed: bool = True) -> bytes:
     public_key_bytes = serialize_public_key(public_key, compressed)
     return ripemd160_sha256(public_key_bytes)
 
 
 def public_key_to_address(public_key: tuple, compressed: bool = True) -> str:
-    return b58check_encode(b'\x00' + public_key_hash(public_key, compressed))
+    return public_key_hash_to_address(public_key_hash(public_key, compressed))
+
+
+def public_key_hash_to_address(pkh: bytes) -> str:
+    """Encode public key hash to p2pkh address"""
+    return b58check_encode(b'\x00' + bytes(pkh))
 
 
 def address_to_public_key_hash(address: str) -> bytes:
@@ -39,6 +76,43 @@ def address_to_public_key_hash(address: str) -> bytes:
     return decoded[1:]
 
 
+# Items per task, and tasks in flight, of bulk conversions farmed to an executor
+BULK_CHUNK_SIZE = 1024
+BULK_PENDING_CHUNKS = 16
+
+
+def _map_chunk(function, chunk: list) -> list:
+    return [function(item) for item in chunk]
+
+
+def _bulk_map(function, items, executor: Executor = None):
+    """Yields function(item) of every item in order, with a bounded number of chunks in flight on the executor"""
+    if executor is None:
+        yield from map(function, items)
+        return
+    iterator = iter(items)
+    pending = deque()
+    while True:
+        while len(pending) < BULK_PENDING_CHUNKS:
+            chunk = list(islice(iterator, BULK_CHUNK_SIZE))
+            if not chunk:
+                break
+            pending.append(executor.submit(_map_chunk, function, chunk))
+        if not pending:
+            return
+        yield from pending.popleft().result()
+
+
+def public_keys_to_addresses(public_keys, compressed: bool = True, executor: Executor = None):
+    """Yields p2pkh address of every public key in the iterable lazily, fanned out to the executor (such as ProcessPoolExecutor) if given"""
+    return _bulk_map(functools.partial(public_key_to_address, compressed=compressed), public_keys, executor)
+
+
+def addresses_to_public_key_hashes(addresses, executor: Executor = None):
+    """Yields public key hash of every p2pkh address in the iterable lazily, fanned out to the executor if given"""
+    return _bulk_map(address_to_public_key_hash, addresses, executor)
+
+
 OP_DUP = b'\x76'
 OP_HASH160 = b'\xa9'
 OP_PUSH_20 = b'\x14'
@@ -52,6 +126,13 @@ def build_locking_script(pkh: bytes) -> bytes:
     return int_to_varint(len(script)) + script
 
 
+def locking_script_to_public_key_hash(script: bytes) -> bytes:
+    """Returns the public key hash of p2pkh locking script (without LEN prefix), raises ValueError for other scripts"""
+    if len(script) != 25 or script[:3] != OP_DUP + OP_HASH160 + OP_PUSH_20 or script[23:] != OP_EQUALVERIFY + OP_CHECKSIG:
+        raise ValueError('Not a p2pkh locking script')
+    return script[3:23]
+
+
 def serialize_signature(signature: tuple) -> bytes:
     """Serialize ECDSA signature (r, s) to bitcoin strict DER format."""
     r, s = signature
@@ -115,3 +196,15 @@ if __name__ == '__main__':
     print(hexlify(serialized_sig))
     decoded_sig = deserialize_signature(serialized_sig)
     print(decoded_sig == sig)
+    # Bulk address derivation, sequentially and on a process pool
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+    from ec_point_operation import scalar_multiply
+
+    keys = [scalar_multiply(k, curve.g) for k in range(1, 2001)]
+    start = time.perf_counter()
+    addresses = list(public_keys_to_addresses(keys))
+    print(f'public_keys_to_addresses {(time.perf_counter() - start) * 1e6 / len(keys):.3f} us/key')
+    with ProcessPoolExecutor() as executor:
+        assert list(public_keys_to_addresses(iter(keys), executor=executor)) == addresses
+        assert list(addresses_to_public_key_hashes(addresses, executor=executor)) == [public_key_hash(key) for key in keys]
@@ -1,3 +1,6 @@
+import instrumentation
+
+
 def extended_euclid_gcd(a: int, b: int) -> list:
     """
     Returns [gcd(a, b), x, y] where ax + by = gcd(a, b)
@@ -15,16 +18,47 @@ def extended_euclid_gcd(a: int, b: int) -> list:
 
 def modular_multiplicative_inverse(a: int, n: int) -> int:
     """
-    Assumes that a and n are co-prime, returns modular multiplicative inverse of a under n
+    Returns modular multiplicative inverse of a under n, raises ValueError if a and n are not co-prime
+    """
+    instrumentation.count('inversion')
+    # Built-in pow runs the extended Euclid's Algorithm in C, result lies in the range [0, n-1]
+    try:
+        return pow(a, -1, n)
+    except ValueError:
+        raise ValueError(f'{a} has no modular multiplicative inverse under {n}') from None
+
+
+def batch_inverse(values: list, modulus: int) -> list:
+    """
+    Returns modular multiplicative inverses of all the values under modulus with only one inversion (Montgomery's trick)
+    Raises ValueError if any value is not co-prime with modulus
     """
-    # Find gcd using Extended Euclid's Algorithm
-    gcd, x, y = extended_euclid_gcd(a, n)
-    # In case x is negative, we handle it by adding extra n
-    # Because we know that modular multiplicative inverse of a in range n lies in the range [0, n-1]
-    if x < 0:
-        x += n
-    return x
+    # prefix_products[i] = values[0] * values[1] * ... * values[i - 1]
+    prefix_products = []
+    product = 1
+    for value in values:
+        prefix_products.append(product)
+        product = product * value % modulus
+    try:
+        inverse = modular_multiplicative_inverse(product, modulus)
+    except ValueError:
+        for i, value in enumerate(values):
+            if extended_euclid_gcd(value % modulus, modulus)[0] != 1:
+                raise ValueError(f'values[{i}] = {value} has no modular multiplicative inverse under {modulus}') from None
+        raise
+    inverses = [0] * len(values)
+    for i in range(len(values) - 1, -1, -1):
+        inverses[i] = inverse * prefix_products[i] % modulus
+        inverse = inverse * values[i] % modulus
+    return inverses
 
 
 if __name__ == '__main__':
     print(modular_multiplicative_inverse(3, 7))
+    print(batch_inverse([2, 3, 4, 5, 6], 7))
+    assert batch_inverse([2, 3, 4, 5, 6], 7) == [modular_multiplicative_inverse(i, 7) for i in [2, 3, 4, 5, 6]]
+    assert batch_inverse([], 7) == []
+    try:
+        batch_inverse([2, 14, 4], 7)
+    except ValueError as e:
+        print(e)
@@ -0,0 +1,313 @@
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict, namedtuple
+
+from ec_point_operation import curve, add, scalar_multiply, Point, INFINITY
+from meta import public_key_to_address
+from modular_inverse import modular_multiplicative_inverse
+from polynomial import Polynomial
+from sign import hash_to_int
+from sign_message import message_digest, serialize_compact_signature
+
+# A protocol message from one player to another, payload is a list of integers
+Message = namedtuple('Message', 'session round sender recipient payload')
+
+
+class MemoryTransport:
+    """Transport delivering messages through in-memory asyncio queues, one queue per player"""
+
+    def __init__(self) -> None:
+        self._queues = {}
+        self._pumps = []
+
+    async def open(self, player_id: int, deliver) -> None:
+        """Register player, deliver(message) is called for every message sent to the player"""
+        queue = asyncio.Queue()
+        self._queues[player_id] = queue
+        self._pumps.append(asyncio.create_task(self._pump(queue, deliver)))
+
+    @staticmethod
+    async def _pump(queue: asyncio.Queue, deliver) -> None:
+        while True:
+            deliver(await queue.get())
+
+    def send(self, message: Message) -> None:
+        self._queues[message.recipient].put_nowait(message)
+
+    async def close(self) -> None:
+        for pump in self._pumps:
+            pump.cancel()
+        await asyncio.gather(*self._pumps, return_exceptions=True)
+        self._pumps.clear()
+
+
+class StreamTransport:
+    """
+    Transport over Unix sockets or localhost TCP, as a stand-in for the network
+    Messages sent in the same event loop iteration to the same player, from any session, are batched in one frame
+    Frame is (4-byte big-endian length || JSON list of messages)
+    """
+
+    def __init__(self, family: str = 'unix', host: str = '127.0.0.1') -> None:
+        if family not in ('unix', 'tcp'):
+            raise ValueError(f'Unsupported transport family {family}')
+        self.family = family
+        self.host = host
+        self._directory = tempfile.mkdtemp(prefix='mpc-') if family == 'unix' else None
+        self._addresses = {}
+        self._servers = []
+        self._writers = {}
+        self._outboxes = defaultdict(list)
+        self._flushing = set()
+        self._tasks = set()
+        self._handlers = set()
+
+    async def open(self, player_id: int, deliver) -> None:
+        """Start a server for the player, deliver(message) is called for every message sent to the player"""
+
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            self._handlers.add(asyncio.current_task())
+            try:
+                while True:
+                    length = int.from_bytes(await reader.readexactly(4), byteorder='big')
+                    for fields in json.loads(await reader.readexactly(length)):
+                        deliver(Message(*fields))
+            except (asyncio.IncompleteReadError, ConnectionResetError):
+                # The sending side closed the connection
+                writer.close()
+
+        if self.family == 'unix':
+            path = os.path.join(self._directory, f'player-{player_id}.sock')
+            server = await asyncio.start_unix_server(handle, path=path)
+            self._addresses[player_id] = path
+        else:
+            server = await asyncio.start_server(handle, host=self.host, port=0)
+            self._addresses[player_id] = server.sockets[0].getsockname()[:2]
+        self._servers.append(server)
+
+    def send(self, message: Message) -> None:
+        self._outboxes[message.recipient].append(message)
+        if message.recipient not in self._flushing:
+            self._flushing.add(message.recipient)
+            task = asyncio.create_task(self._flush(message.recipient))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _connect(self, recipient: int) -> asyncio.StreamWriter:
+        if recipient not in self._writers:
+            if self.family == 'unix':
+                _, writer = await asyncio.open_unix_connection(self._addresses[recipient])
+            else:
+                _, writer = await asyncio.open_connection(*self._addresses[recipient])
+            self._writers[recipient] = writer
+        return self._writers[recipient]
+
+    async def _flush(self, recipient: int) -> None:
+        """Write all the messages queued for the recipient in one frame"""
+        # Let the other players and sessions queue their messages of this round first
+        await asyncio.sleep(0)
+        writer = await self._connect(recipient)
+        messages = self._outboxes.pop(recipient, [])
+        self._flushing.discard(recipient)
+        frame = json.dumps([list(message) for message in messages]).encode('ascii')
+        writer.write(len(frame).to_bytes(4, byteorder='big') + frame)
+        await writer.drain()
+
+    async def close(self) -> None:
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for writer in self._writers.values():
+            writer.close()
+            await writer.wait_closed()
+        # Connection handlers finish once they read the end of their streams
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        self._handlers.clear()
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._writers.clear()
+        self._servers.clear()
+        if self._directory is not None:
+            for name in os.listdir(self._directory):
+                os.remove(os.path.join(self._directory, name))
+            os.rmdir(self._directory)
+            self._directory = None
+
+
+class Player:
+    """One participant of the group, runs jvrss, pross, invss and signing as rounds of messages with the other players"""
+
+    def __init__(self, player_id: int, runtime: 'MultiPartyRuntime') -> None:
+        self.player_id = player_id
+        self.runtime = runtime
+        self.share = 0
+        self.public_key = INFINITY
+        # (session, round) -> {sender: payload}
+        self._mailboxes = defaultdict(dict)
+        # (session, round) -> future resolved when messages from all the players arrived
+        self._waiters = {}
+
+    def deliver(self, message: Message) -> None:
+        key = (message.session, message.round)
+        mailbox = self._mailboxes[key]
+        mailbox[message.sender] = message.payload
+        waiter = self._waiters.get(key)
+        if waiter is not None and len(mailbox) == self.runtime.group_size and not waiter.done():
+            waiter.set_result(None)
+
+    def send_each(self, session: str, round_name: str, payloads: list) -> None:
+        """Send payloads[i] to player i + 1"""
+        for recipient, payload in zip(self.runtime.participant_ids, payloads):
+            self.runtime.transport.send(Message(session, round_name, self.player_id, recipient, payload))
+
+    def broadcast(self, session: str, round_name: str, payload: list) -> None:
+        """Send the same payload to every player, including itself"""
+        self.send_each(session, round_name, [payload] * self.runtime.group_size)
+
+    async def gather(self, session: str, round_name: str) -> dict:
+        """Returns {sender: payload} of the round once every player's message arrived"""
+        key = (session, round_name)
+        start = time.perf_counter()
+        if len(self._mailboxes[key]) < self.runtime.group_size:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters[key] = waiter
+            try:
+                await waiter
+            finally:
+                del self._waiters[key]
+        self.runtime.round_seconds[round_name] += time.perf_counter() - start
+        self.runtime.round_waits[round_name] += 1
+        return self._mailboxes.pop(key)
+
+    def interpolate(self, values: dict, count: int) -> int:
+        """Interpolate at 0 the values of the first count players, always the same subset, so its Lagrange coefficients stay cached"""
+        ids = self.runtime.participant_ids[:count]
+        coefficients = Polynomial.lagrange_coefficients(ids, 0)
+        return sum(coefficients[i] * values[i] for i in ids) % curve.n
+
+    async def jvrss(self, session: str) -> tuple:
+        """Returns (share, shared_public_key), every player deals f(j) and its public contribution a0 * G to player j in one round"""
+        p = Polynomial.random(self.runtime.polynomial_order)
+        public_contribution = list(scalar_multiply(p.coefficients[0], curve.g))
+        evaluations = p.evaluate_many(self.runtime.participant_ids)
+        self.send_each(session, 'jvrss', [[fj] + public_contribution for fj in evaluations])
+        received = await self.gather(session, 'jvrss')
+        share, public_key = 0, INFINITY
+        for fj, x, y in received.values():
+            share += fj
+            # Validate the point at the boundary, the arithmetic trusts it afterwards
+            public_key = add(public_key, Point(x, y))
+        return share % curve.n, public_key
+
+    async def pross(self, session: str, a: int, b: int) -> int:
+        """Returns the secret product of a and b, every player publishes its share of a * b"""
+        self.broadcast(session, 'pross', [a * b % curve.n])
+        received = await self.gather(session, 'pross')
+        return self.interpolate({i: payload[0] for i, payload in received.items()}, self.runtime.signature_threshold)
+
+    async def invss(self, session: str, a: int) -> int:
+        """Returns the share of the modular multiplicative inverse of a"""
+        b, _ = await self.jvrss(f'{session}/b')
+        u = await self.pross(session, a, b)
+        return modular_multiplicative_inverse(u, curve.n) * b % curve.n
+
+    async def keygen(self, session: str) -> None:
+        self.share, self.public_key = await self.jvrss(session)
+
+    async def sign(self, session: str, e: int) -> tuple:
+        """Returns the compact signature (recovery_id, r, s) of the message hash e"""
+        for attempt in itertools.count():
+            attempt_session = f'{session}/{attempt}'
+            k, k_public_key = await self.jvrss(f'{attempt_session}/k')
+            k_x, k_y = k_public_key
+            r = k_x % curve.n
+            if not r:
+                continue
+            recovery_id = 0 | 2 if k_x > curve.n else 0 | k_y % 2
+            mod_inv_k = await self.invss(f'{attempt_session}/inv', k)
+            self.broadcast(attempt_session, 'sign', [(e + r * self.share) * mod_inv_k % curve.n])
+            received = await self.gather(attempt_session, 'sign')
+            s = self.interpolate({i: payload[0] for i, payload in received.items()}, self.runtime.signature_threshold)
+            if s:
+                return recovery_id, r, s
+
+
+class MultiPartyRuntime:
+    """
+    Runs every player of the group as its own asyncio task, exchanging protocol messages through the transport
+    Many signing sessions can run concurrently on one event loop, their messages are told apart by session id
+    """
+
+    def __init__(self, group_size: int, threshold: int, transport=None) -> None:
+        if group_size < 3:
+            raise ValueError(f'Nakasendo group size should be 3 at least')
+        self.group_size = group_size
+        self.polynomial_order = threshold - 1
+        self.key_threshold = self.polynomial_order + 1
+        self.signature_threshold = 2 * self.polynomial_order + 1
+        if self.polynomial_order < 1 or self.key_threshold > group_size or self.signature_threshold > group_size:
+            raise ValueError(f'Nakasendo threshold should be in interval [2, {(group_size - 1) // 2 + 1}] with {group_size} players')
+        self.transport = transport if transport is not None else MemoryTransport()
+        self.participant_ids = list(range(1, group_size + 1))
+        self.players = [Player(i, self) for i in self.participant_ids]
+        self.public_key = INFINITY
+        # round name -> total seconds players waited for the messages of the round, and number of waits
+        # Running sums rather than every latency, so that a long-lived runtime uses constant memory
+        self.round_seconds = defaultdict(float)
+        self.round_waits = defaultdict(int)
+        self._sessions = itertools.count()
+
+    async def __aenter__(self) -> 'MultiPartyRuntime':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    async def start(self) -> None:
+        """Open the transport for every player, then generate the shared key with jvrss"""
+        for player in self.players:
+            await self.transport.open(player.player_id, player.deliver)
+        await asyncio.gather(*(player.keygen('keygen') for player in self.players))
+        self.public_key = self.players[0].public_key
+
+    async def close(self) -> None:
+        await self.transport.close()
+
+    async def sign_recoverable(self, message: bytes) -> tuple:
+        """Create ECDSA compact signature (recovery_id, r, s), every player runs the signing rounds as a separate task"""
+        e = hash_to_int(message)
+        session = f'sign-{next(self._sessions)}'
+        signatures = await asyncio.gather(*(player.sign(session, e) for player in self.players))
+        return signatures[0]
+
+    async def sign_message(self, plain_text: str) -> tuple:
+        """Sign arbitrary message, returns (p2pkh_address, serialized_compact_signature)"""
+        recovery_id, r, s = await self.sign_recoverable(message_digest(plain_text))
+        return public_key_to_address(self.public_key, compressed=True), serialize_compact_signature(recovery_id, r, s, compressed=True)
+
+    def round_latency(self) -> dict:
+        """Returns {round name: average seconds a player waited for the round}"""
+        return {name: seconds / self.round_waits[name] for name, seconds in self.round_seconds.items()}
+
+
+if __name__ == '__main__':
+    from sign_message import verify_message
+
+    async def demo(transport) -> None:
+        async with MultiPartyRuntime(group_size=5, threshold=2, transport=transport) as runtime:
+            texts = [f'Concurrent signing session {i}' for i in range(10)]
+            start = time.perf_counter()
+            results = await asyncio.gather(*(runtime.sign_message(text) for text in texts))
+            elapsed = time.perf_counter() - start
+            assert all(verify_message(address, text, sig) for text, (address, sig) in zip(texts, results))
+            print(f'{type(transport).__name__} {getattr(transport, "family", "memory")}: {len(texts)} concurrent sessions in {elapsed * 1000:.1f} ms')
+            for name, latency in runtime.round_latency().items():
+                print(f'    round {name} {latency * 1000:.3f} ms')
+
+    asyncio.run(demo(MemoryTransport()))
+    asyncio.run(demo(StreamTransport('unix')))
+    asyncio.run(demo(StreamTransport('tcp')))
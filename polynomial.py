@@ -1,6 +1,121 @@
+import functools
 import random
 
-from ec_point_operation import curve, modular_multiplicative_inverse
+import instrumentation
+from ec_point_operation import curve
+from modular_inverse import batch_inverse
+
+
+# Maximum number of (participant ids, x) entries kept in the Lagrange coefficients cache
+LAGRANGE_CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=LAGRANGE_CACHE_SIZE)
+def _lagrange_coefficients(ids: frozenset, x: int) -> dict:
+    """Returns {id: coefficient} of Lagrange basis polynomials at x, all the denominators are inverted with one inversion"""
+    instrumentation.count('lagrange_cache_miss')
+    xs = list(ids)
+    numerators, denominators = [], []
+    for i in range(len(xs)):
+        numerator, denominator = 1, 1
+        for j in range(len(xs)):
+            if j != i:
+                numerator = numerator * (x - xs[j]) % curve.n
+                denominator = denominator * (xs[i] - xs[j]) % curve.n
+        numerators.append(numerator)
+        denominators.append(denominator)
+    try:
+        mod_inv_denominators = batch_inverse(denominators, curve.n)
+    except ValueError:
+        raise ValueError('Lagrange interpolation requires distinct x of points modulo n') from None
+    return {xs[i]: numerators[i] * mod_inv_denominators[i] % curve.n for i in range(len(xs))}
+
+
+def _multiply_coefficients(a: list, b: list) -> list:
+    """Returns coefficients of a * b mod n, packing both into big integers (Kronecker substitution) for one big multiplication"""
+    # Width in bytes of each packed coefficient, wide enough for sums of min(len(a), len(b)) products
+    width = (2 * curve.n.bit_length() + min(len(a), len(b)).bit_length() + 7) // 8
+    packed_a = int.from_bytes(b''.join(c.to_bytes(width, 'little') for c in a), 'little')
+    packed_b = int.from_bytes(b''.join(c.to_bytes(width, 'little') for c in b), 'little')
+    length = len(a) + len(b) - 1
+    packed = (packed_a * packed_b).to_bytes(length * width, 'little')
+    return [int.from_bytes(packed[i * width:(i + 1) * width], 'little') % curve.n for i in range(length)]
+
+
+def _series_inverse(h: list, precision: int) -> list:
+    """Returns g with h * g = 1 mod x^precision by Newton iteration, h[0] should be 1"""
+    g = [1]
+    current = 1
+    while current < precision:
+        current = min(2 * current, precision)
+        # g = g * (2 - h * g) mod x^current
+        e = [-c % curve.n for c in _multiply_coefficients(h[:current], g)[:current]]
+        e[0] = (e[0] + 2) % curve.n
+        g = _multiply_coefficients(g, e)[:current]
+    return g + [0] * (precision - len(g))
+
+
+def _remainder(f: list, node: tuple) -> list:
+    """Returns coefficients of f mod the monic polynomial of the subproduct tree node"""
+    modulus, inverse = node[0], node[3]
+    m = len(modulus) - 1
+    k = len(f) - m
+    if k <= 0:
+        return f
+    if len(inverse) < k:
+        inverse = _series_inverse(modulus[::-1], k)
+    # Quotient from the reversed polynomials, q = rev(rev(f) * rev(modulus)^-1 mod x^k)
+    q = _multiply_coefficients(f[::-1][:k], inverse[:k])[:k][::-1]
+    qm = _multiply_coefficients(q, modulus)
+    return [(f[i] - qm[i]) % curve.n for i in range(m)]
+
+
+# Number of points below which a subproduct tree node evaluates with Horner's rule directly
+SUBPRODUCT_LEAF_SIZE = 16
+
+
+@functools.lru_cache(maxsize=16)
+def _subproduct_tree(xs: tuple, parent_degree: int = 0) -> tuple:
+    """
+    Returns the subproduct tree node (modulus, left, right, inverse) of points xs, modulus = (x - x1)(x - x2)...
+    inverse is the reversed modulus inverted mod x^(parent_degree - degree), enough to reduce any remainder of the parent node
+    """
+    if len(xs) <= SUBPRODUCT_LEAF_SIZE:
+        modulus = [1]
+        for x in xs:
+            modulus = _multiply_coefficients(modulus, [-x % curve.n, 1])
+        left, right = None, None
+    else:
+        middle = len(xs) // 2
+        left = _subproduct_tree(xs[:middle], len(xs))
+        right = _subproduct_tree(xs[middle:], len(xs))
+        modulus = _multiply_coefficients(left[0], right[0])
+    inverse = _series_inverse(modulus[::-1], parent_degree - len(xs)) if parent_degree > len(xs) else []
+    return modulus, left, right, inverse
+
+
+def _horner(coefficients: list, x: int) -> int:
+    """Returns y at x with Horner's rule, reducing mod n at every step"""
+    y = 0
+    for coefficient in reversed(coefficients):
+        y = (y * x + coefficient) % curve.n
+    return y
+
+
+def _evaluate_tree(f: list, xs: tuple, node: tuple) -> list:
+    """Returns [f(x) for x in xs], reducing f down the subproduct tree"""
+    f = _remainder(f, node)
+    if node[1] is None:
+        return [_horner(f, x) for x in xs]
+    middle = len(xs) // 2
+    return _evaluate_tree(f, xs[:middle], node[1]) + _evaluate_tree(f, xs[middle:], node[2])
+
+
+# Polynomial order from which evaluate_many switches from Horner's rule to subproduct tree evaluation
+# Measured crossover with order + 1 random points, below it the tree construction costs more than it saves
+MULTIPOINT_ORDER_THRESHOLD = 400
+# Horner's rule stays faster on small x such as participant ids, whose products with the coefficients are cheap
+MULTIPOINT_SMALL_X_BITS = 64
 
 
 class Polynomial:
@@ -9,37 +124,43 @@ class Polynomial:
     """
 
     @staticmethod
-    def random(order: int, debug: bool = False) -> 'Polynomial':
-        """Random a polynomial with the specific order"""
+    def random(order: int, debug: bool = False, rng: random.Random = None) -> 'Polynomial':
+        """Random a polynomial with the specific order, with the module level random generator if rng is not given"""
         if order < 1:
             raise ValueError(f'The polynomial order should be a positive integer.')
+        rng = rng or random
         range_stop = 10 if debug else curve.n
-        coefficients = [random.randrange(1, range_stop)]
+        coefficients = [rng.randrange(1, range_stop)]
         for i in range(order):
-            coefficients.append(random.randrange(1, range_stop))
+            coefficients.append(rng.randrange(1, range_stop))
         return Polynomial(coefficients)
 
+    @staticmethod
+    def lagrange_coefficients(ids, x: int) -> dict:
+        """
+        Returns {id: coefficient} of the Lagrange basis polynomials of points with x-coordinates ids, evaluated at x
+        Results are cached by (frozenset(ids), x) with LRU eviction, the returned dict is shared and should not be modified
+        """
+        return _lagrange_coefficients(frozenset(ids), x)
+
+    @staticmethod
+    def interpolate_with_coefficients(coefficients: dict, points: list) -> int:
+        """Returns y = sum(coefficient * share) of points [(id, share), ...] with precomputed Lagrange coefficients"""
+        instrumentation.count('interpolation')
+        y = 0
+        for participant_id, share in points:
+            y += coefficients[participant_id] * share
+        return y % curve.n
+
     @staticmethod
     def interpolate_evaluate(points: list, x: int) -> int:
         """Lagrange interpolate with the giving points, then evaluate y at x"""
         if len(points) < 2:
             raise ValueError('Lagrange interpolation requires at least 2 points')
-        # [(numerator, denominator) ...]
-        lagrange = [(0, 0)] * len(points)
-        # the product of all the denominator
-        denominator_product = 1
-        for i in range(len(points)):
-            numerator, denominator = 1, 1
-            for j in range(len(points)):
-                if j != i:
-                    numerator *= (x - points[j][0])
-                    denominator *= (points[i][0] - points[j][0])
-            lagrange[i] = (points[i][1] * numerator, denominator)
-            denominator_product *= denominator
-        numerator_sum = 0
-        for (numerator, denominator) in lagrange:
-            numerator_sum += numerator * denominator_product // denominator
-        return numerator_sum * modular_multiplicative_inverse(denominator_product, curve.n) % curve.n
+        ids = frozenset(point[0] for point in points)
+        if len(ids) != len(points):
+            raise ValueError('Lagrange interpolation requires distinct x of points')
+        return Polynomial.interpolate_with_coefficients(_lagrange_coefficients(ids, x), points)
 
     def __init__(self, coefficients: list) -> None:
         if len(coefficients) < 2:
@@ -51,11 +172,16 @@ class Polynomial:
         """Calculate y for the specific x"""
         if x == 0:
             return self.coefficients[0]
-        y, pow_x = 0, 1
-        for i in range(len(self.coefficients)):
-            y += self.coefficients[i] * pow_x
-            pow_x *= x
-        return y % curve.n
+        return _horner(self.coefficients, x)
+
+    def evaluate_many(self, xs: list) -> list:
+        """Calculate [y for each x in xs] in one pass, with subproduct tree multipoint evaluation for large orders"""
+        xs = tuple(xs)
+        instrumentation.count('polynomial_evaluation', len(xs))
+        if self.order < MULTIPOINT_ORDER_THRESHOLD or len(xs) <= SUBPRODUCT_LEAF_SIZE or max(xs).bit_length() <= MULTIPOINT_SMALL_X_BITS:
+            return [self.evaluate(x) for x in xs]
+        coefficients = [c % curve.n for c in self.coefficients]
+        return _evaluate_tree(coefficients, xs, _subproduct_tree(xs))
 
     def add(self, other: 'Polynomial') -> 'Polynomial':
         """Returns the polynomial = self + other"""
@@ -122,3 +248,11 @@ if __name__ == '__main__':
     assert Polynomial.interpolate_evaluate(p, 0) == 90
     assert Polynomial.interpolate_evaluate(p, 1) == 350
     assert Polynomial.interpolate_evaluate(p, 2) == 770
+    assert Polynomial.interpolate_evaluate(p, 0) == 90
+    assert f.evaluate_many([0, 1, 2]) == [f.evaluate(0), f.evaluate(1), f.evaluate(2)]
+    h = Polynomial.random(order=MULTIPOINT_ORDER_THRESHOLD)
+    xs = [random.randrange(curve.n) for _ in range(2 * MULTIPOINT_ORDER_THRESHOLD)]
+    assert h.evaluate_many(xs) == [h.evaluate(x) for x in xs]
+    coefficients = Polynomial.lagrange_coefficients([3, 1, 2], 0)
+    assert Polynomial.interpolate_with_coefficients(coefficients, p) == 90
+    print(_lagrange_coefficients.cache_info())
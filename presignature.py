@@ -0,0 +1,100 @@
+import threading
+from collections import deque, namedtuple
+
+# Message independent part of a threshold signature
+#   r, recovery_id      from the group nonce point k * G
+#   mod_inv_k_shares    ShareVector of k^-1
+#   ids                 participants picked to interpolate s, Lagrange coefficients of which are cached in advance
+Presignature = namedtuple('Presignature', 'r recovery_id mod_inv_k_shares ids')
+
+
+class PresignaturePool:
+    """
+    Pool of presignatures filled by a background worker
+    The worker refills the pool up to target_size whenever it drops below low_water_mark, each presignature is taken exactly once
+    """
+
+    def __init__(self, presign, target_size: int = 16, low_water_mark: int = 4) -> None:
+        # At 0 the pool could never drop below low_water_mark, so the worker would never fill it
+        if not 1 <= low_water_mark <= target_size:
+            raise ValueError(f'Presignature pool should have 1 <= low_water_mark <= target_size')
+        self.presign = presign
+        self.target_size = target_size
+        self.low_water_mark = low_water_mark
+        self._presignatures = deque()
+        self._condition = threading.Condition()
+        self._running = True
+        self._error = None
+        self._worker = threading.Thread(target=self._fill, name='presignature-pool', daemon=True)
+        self._worker.start()
+
+    def __len__(self) -> int:
+        return len(self._presignatures)
+
+    def __enter__(self) -> 'PresignaturePool':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def _fill(self) -> None:
+        """Worker loop, sleeps while the pool holds at least low_water_mark presignatures"""
+        while True:
+            with self._condition:
+                while self._running and len(self._presignatures) >= self.low_water_mark:
+                    self._condition.wait()
+                if not self._running:
+                    return
+            while self._running and len(self._presignatures) < self.target_size:
+                try:
+                    presignature = self.presign()
+                except Exception as e:
+                    with self._condition:
+                        self._error = e
+                        self._running = False
+                        self._condition.notify_all()
+                    return
+                with self._condition:
+                    if not self._running:
+                        return
+                    self._presignatures.append(presignature)
+                    self._condition.notify_all()
+
+    def take(self) -> Presignature:
+        """Returns a presignature removed from the pool, computes one right now if the pool is empty"""
+        with self._condition:
+            if self._error is not None:
+                raise RuntimeError('Presignature worker failed') from self._error
+            presignature = self._presignatures.popleft() if self._presignatures else None
+            if len(self._presignatures) < self.low_water_mark:
+                self._condition.notify_all()
+        return presignature if presignature is not None else self.presign()
+
+    def take_up_to(self, count: int) -> list:
+        """Returns at most count presignatures removed from the pool without computing any, fewer if the pool holds fewer"""
+        with self._condition:
+            if self._error is not None:
+                raise RuntimeError('Presignature worker failed') from self._error
+            presignatures = [self._presignatures.popleft() for _ in range(min(count, len(self._presignatures)))]
+            if len(self._presignatures) < self.low_water_mark:
+                self._condition.notify_all()
+        return presignatures
+
+    def wait_filled(self, timeout: float = None) -> bool:
+        """
+        Block until the pool holds target_size presignatures, returns False on timeout or if the pool is stopped
+        Raises RuntimeError if the worker failed
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._presignatures) >= self.target_size or not self._running, timeout)
+            if self._error is not None:
+                raise RuntimeError('Presignature worker failed') from self._error
+            return len(self._presignatures) >= self.target_size
+
+    def stop(self) -> None:
+        """Stop the worker, presignatures left in the pool are discarded"""
+        with self._condition:
+            self._running = False
+            self._presignatures.clear()
+            self._condition.notify_all()
+        self._worker.join()
@@ -0,0 +1,105 @@
+import random
+
+import instrumentation
+from ec_point_operation import curve
+from polynomial import Polynomial
+
+# Width in bytes of each serialized share
+SHARE_BYTES = 32
+
+
+class ShareVector(list):
+    """
+    Shares [s1, s2, ...] of a secret on finite field Secp256k1.n, held by participants with ids [id1, id2, ...]
+    Still a list of shares, so it can be indexed and printed as before, arithmetic is elementwise mod n
+    """
+
+    __slots__ = ('ids', '_positions')
+
+    def __init__(self, shares: list, ids: tuple = None) -> None:
+        super().__init__(shares)
+        self.ids = tuple(ids) if ids is not None else tuple(range(1, len(self) + 1))
+        if len(self.ids) != len(self):
+            raise ValueError(f'{len(self)} shares do not match {len(self.ids)} participant ids')
+        self._positions = None
+
+    @staticmethod
+    def from_bytes(serialized: bytes, ids: tuple = None) -> 'ShareVector':
+        """Deserialize shares from fixed-width 32-byte big-endian records"""
+        if len(serialized) % SHARE_BYTES != 0:
+            raise ValueError(f'Serialized shares length {len(serialized)} is not a multiple of {SHARE_BYTES}')
+        view = memoryview(serialized)
+        shares = [int.from_bytes(view[i:i + SHARE_BYTES], byteorder='big') for i in range(0, len(view), SHARE_BYTES)]
+        return ShareVector(shares, ids)
+
+    def to_bytes(self) -> bytes:
+        """Serialize shares to fixed-width 32-byte big-endian records, in the order of participant ids"""
+        return b''.join(share.to_bytes(SHARE_BYTES, byteorder='big') for share in self)
+
+    def _check_ids(self, other: list) -> None:
+        if len(other) != len(self) or (isinstance(other, ShareVector) and other.ids != self.ids):
+            raise ValueError('Share vectors should be held by the same participants')
+
+    def add(self, other: list) -> 'ShareVector':
+        """Returns shares of a + b, [(ai + bi) mod n, ...]"""
+        self._check_ids(other)
+        return ShareVector([(a + b) % curve.n for a, b in zip(self, other)], self.ids)
+
+    def multiply(self, other: list) -> 'ShareVector':
+        """Returns shares of a * b on a polynomial of double order, [(ai * bi) mod n, ...]"""
+        self._check_ids(other)
+        return ShareVector([(a * b) % curve.n for a, b in zip(self, other)], self.ids)
+
+    def scale(self, k: int) -> 'ShareVector':
+        """Returns shares of k * a, [(k * ai) mod n, ...]"""
+        return ShareVector([(k * a) % curve.n for a in self], self.ids)
+
+    def points(self) -> list:
+        """Returns [(participant_id, share), (participant_id, share), ...]"""
+        return list(zip(self.ids, self))
+
+    def share_of(self, participant_id: int) -> int:
+        """Returns the share held by the participant"""
+        if self._positions is None:
+            self._positions = {participant_id: i for i, participant_id in enumerate(self.ids)}
+        return self[self._positions[participant_id]]
+
+    def sample_ids(self, count: int) -> list:
+        """Returns ids of count participants picked at random"""
+        return random.sample(self.ids, count)
+
+    def interpolate(self, ids: list, x: int = 0) -> int:
+        """Interpolate the shares of the participants in ids with cached Lagrange coefficients, then evaluate at x"""
+        if len(ids) < 2:
+            raise ValueError('Lagrange interpolation requires at least 2 points')
+        coefficients = Polynomial.lagrange_coefficients(ids, x)
+        if len(coefficients) != len(ids):
+            raise ValueError('Lagrange interpolation requires distinct x of points')
+        instrumentation.count('interpolation')
+        y = 0
+        for participant_id in ids:
+            y += coefficients[participant_id] * self.share_of(participant_id)
+        return y % curve.n
+
+
+def as_share_vector(shares: list) -> ShareVector:
+    """Returns shares as a ShareVector, plain lists are held by participants [1, 2, ..., len(shares)]"""
+    if isinstance(shares, ShareVector):
+        return shares
+    return ShareVector(shares)
+
+
+if __name__ == '__main__':
+    # Shares of f(x) = 90 + 200x + 60x^2 and g(x) = 3 + 5x + 7x^2
+    a = ShareVector([350, 730, 1230])
+    b = as_share_vector([15, 41, 81])
+    print(a, a.ids)
+    assert a.add(b).interpolate([1, 2, 3]) == 93
+    assert a.scale(2).interpolate([3, 1, 2]) == 180
+    c = ShareVector([Polynomial([90, 200, 60]).evaluate(i) * Polynomial([3, 5, 7]).evaluate(i) for i in range(1, 6)])
+    assert a.multiply(b) == c[:3]
+    assert c.interpolate(c.sample_ids(5)) == 270
+    serialized = c.to_bytes()
+    assert len(serialized) == 5 * SHARE_BYTES
+    assert ShareVector.from_bytes(serialized) == c
+    print(c.points())
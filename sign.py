@@ -1,8 +1,9 @@
 import random
+import secrets
 
 from crypto import double_sha256, sha256
-from ec_point_operation import curve, add, scalar_multiply
-from modular_inverse import modular_multiplicative_inverse
+from ec_point_operation import curve, add, negative, scalar_multiply, multi_scalar_multiply, as_point, Point, INFINITY
+from modular_inverse import modular_multiplicative_inverse, batch_inverse
 
 
 def hash_to_int(message: bytes) -> int:
@@ -40,15 +41,145 @@ def sign_recoverable(private_key: int, message: bytes) -> tuple:
 
 def verify_signature(public_key: tuple, message: bytes, signature: tuple) -> bool:
     """Verify signature with public key and message"""
-    e = hash_to_int(message)
     r, s = signature
+    if not 0 < r < curve.n or not 0 < s < curve.n:
+        return False
+    e = hash_to_int(message)
     w = modular_multiplicative_inverse(s, curve.n)
     u1 = (w * e) % curve.n
     u2 = (w * r) % curve.n
-    x, _ = add(scalar_multiply(u1, curve.g), scalar_multiply(u2, public_key))
+    # Public keys are verified again and again, hot ones get a cached fixed-base table
+    point = multi_scalar_multiply([(u1, curve.g), (u2, public_key)], precomputed=True)
+    if point is INFINITY:
+        return False
+    x, _ = point
     return r == (x % curve.n)
 
 
+def recover_nonce_point(r: int, recovery_id: int) -> Point or None:
+    """Returns the point R = kG of a compact signature from r and its recovery_id, None if there is no such point"""
+    x = r + (curve.n if recovery_id >= 2 else 0)
+    if x >= curve.p:
+        return None
+    y_squared = (x * x * x + curve.a * x + curve.b) % curve.p
+    y = pow(y_squared, (curve.p + 1) // 4, curve.p)
+    if y * y % curve.p != y_squared:
+        return None
+    if (y + recovery_id) % 2 != 0:
+        y = -y % curve.p
+    return Point(x, y)
+
+
+def recover_public_key(message: bytes, signature: tuple) -> Point or None:
+    """
+    Returns the public key recovered from compact signature (recovery_id, r, s) of the message, None if the signature is invalid
+    The recovered key Q = r^-1 * (s * R - e * G) satisfies the verification equation by construction, no further check is needed
+    """
+    recovery_id, r, s = signature
+    if not 0 < r < curve.n or not 0 < s < curve.n:
+        return None
+    # Recover point R = kG, k is the ephemeral private key
+    point_r = recover_nonce_point(r, recovery_id)
+    if point_r is None:
+        return None
+    e = hash_to_int(message)
+    mod_inv_r = modular_multiplicative_inverse(r, curve.n)
+    public_key = multi_scalar_multiply([(mod_inv_r * s, point_r), (mod_inv_r * -e, curve.g)])
+    return None if public_key is INFINITY else public_key
+
+
+def _verify_prepared(public_key: tuple, u1: int, u2: int, r: int) -> bool:
+    """Verify signature once u1 = e / s and u2 = r / s are known"""
+    point = multi_scalar_multiply([(u1, curve.g), (u2, public_key)], precomputed=True)
+    return point is not INFINITY and r == point.x % curve.n
+
+
+# Groups of at most this many signatures are verified one by one once their combination fails
+VERIFY_BATCH_MIN_SIZE = 8
+
+
+def _combination(group: list, weights: list) -> Point:
+    """Returns sum(z * (u1 * G + u2 * public_key - R)) of items [(index, public_key, u1, u2, r, point_r), ...] and their weights z"""
+    g_scalar = 0
+    key_scalars = {}
+    terms = []
+    for (_, public_key, u1, u2, _, point_r), z in zip(group, weights):
+        g_scalar += z * u1
+        # Items signed by the same public key share one term
+        key_scalars[public_key] = key_scalars.get(public_key, 0) + z * u2
+        terms.append((-z, point_r))
+    terms.append((g_scalar, curve.g))
+    terms.extend((scalar, public_key) for public_key, scalar in key_scalars.items())
+    return multi_scalar_multiply(terms)
+
+
+def _verify_combined(group: list, results: list, weights: list = None, combination: Point = None) -> None:
+    """
+    Verify items [(index, public_key, u1, u2, r, point_r), ...] together by checking a random linear combination
+        sum(z * (u1 * G + u2 * public_key - R)) == 0
+    If the check fails, the group is split in halves, the combination of the right half is the total minus the left one
+    Small groups, and groups both halves of which fail, are verified one by one, bisecting them further costs more
+    """
+    if weights is None:
+        # Weights must be unpredictable, or invalid signatures can be crafted to cancel out
+        weights = [secrets.randbelow((1 << 128) - 1) + 1 for _ in group]
+        combination = _combination(group, weights)
+    if combination is INFINITY:
+        for index, *_ in group:
+            results[index] = True
+        return
+    middle = len(group) // 2
+    if len(group) > VERIFY_BATCH_MIN_SIZE:
+        left = _combination(group[:middle], weights[:middle])
+        right = add(combination, negative(left))
+        if left is INFINITY or right is INFINITY:
+            _verify_combined(group[:middle], results, weights[:middle], left)
+            _verify_combined(group[middle:], results, weights[middle:], right)
+            return
+    for index, public_key, u1, u2, r, _ in group:
+        results[index] = _verify_prepared(public_key, u1, u2, r)
+
+
+def verify_batch(items) -> list:
+    """
+    Verify many signatures at once, items is a list or iterable of (public_key, message, signature), returns [bool, ...]
+    Signature is (r, s), or compact signature (recovery_id, r, s) which is verified together with the others in one multi scalar multiplication
+    """
+    items = list(items)
+    results = [False] * len(items)
+    # Hash each distinct message only once
+    digests = {}
+    prepared = []
+    for index, (public_key, message, signature) in enumerate(items):
+        recovery_id, r, s = signature if len(signature) == 3 else (None, *signature)
+        if not 0 < r < curve.n or not 0 < s < curve.n:
+            continue
+        # Validate the public key once, the arithmetic trusts it afterwards
+        try:
+            public_key = as_point(public_key)
+        except ValueError:
+            continue
+        if public_key is INFINITY:
+            continue
+        if message not in digests:
+            digests[message] = hash_to_int(message)
+        prepared.append((index, public_key, digests[message], r, s, recovery_id))
+    # One modular inversion for all the s
+    mod_inv_s = batch_inverse([item[4] for item in prepared], curve.n)
+    combined = []
+    for (index, public_key, e, r, _, recovery_id), w in zip(prepared, mod_inv_s):
+        u1 = (w * e) % curve.n
+        u2 = (w * r) % curve.n
+        point_r = recover_nonce_point(r, recovery_id) if recovery_id is not None else None
+        if point_r is None:
+            results[index] = _verify_prepared(public_key, u1, u2, r)
+        else:
+            combined.append((index, public_key, u1, u2, r, point_r))
+    if combined:
+        _verify_combined(combined, results)
+    return results
+
+
 if __name__ == '__main__':
     priv_key = 0xf97c89aaacf0cd2e47ddbacc97dae1f88bec49106ac37716c451dcdd008a4b62
     pub_key = scalar_multiply(priv_key, curve.g)
@@ -64,3 +195,23 @@ if __name__ == '__main__':
     negative_s = -sig_s % curve.n
     print('-s =', negative_s)
     print(verify_signature(pub_key, digest, (sig_r, negative_s)))
+    # Verify in batch
+    import timeit
+
+    batch = []
+    for i in range(100):
+        msg = sha256(str(i).encode('utf-8'))
+        batch.append((pub_key, msg, sign_recoverable(priv_key, msg)))
+    batch[42] = (pub_key, batch[42][1], batch[43][2])
+    batch_results = verify_batch(batch)
+    assert batch_results == [verify_signature(pub_key, msg, sig[1:]) for pub_key, msg, sig in batch]
+    print(batch_results.count(True), 'of', len(batch), 'valid, invalid at', batch_results.index(False))
+    batch[42] = (pub_key, batch[42][1], sign_recoverable(priv_key, batch[42][1]))
+    single_time = timeit.timeit(lambda: [verify_signature(pub_key, msg, sig[1:]) for pub_key, msg, sig in batch], number=1)
+    batch_time = timeit.timeit(lambda: verify_batch(batch), number=1)
+    print(f'verify_signature {single_time * 1000 / len(batch):.3f} ms/signature')
+    print(f'verify_batch     {batch_time * 1000 / len(batch):.3f} ms/signature')
+    # The key is hot by now, its fixed-base table is cached
+    from ec_point_operation import precomputed_tables
+
+    print(precomputed_tables.info())
@@ -1,9 +1,8 @@
 from base64 import b64encode, b64decode
 
-from ec_point_operation import curve, add, scalar_multiply
+from ec_point_operation import curve, scalar_multiply
 from meta import int_to_varint, public_key_to_address, address_to_public_key_hash, public_key_hash
-from modular_inverse import modular_multiplicative_inverse
-from sign import hash_to_int, sign_recoverable, verify_signature
+from sign import sign_recoverable, recover_public_key
 
 
 def message_bytes(message: str) -> bytes:
@@ -17,6 +16,14 @@ def message_digest(message: str) -> bytes:
     return message_bytes('Bitcoin Signed Message:\n') + message_bytes(message)
 
 
+def serialize_compact_signature(recovery_id: int, r: int, s: int, compressed: bool = True) -> str:
+    """Serialize recoverable signature to base64 encoded (prefix || r || s)"""
+    # prefix = 27 + recovery_id + (4 if using compressed public key else 0)
+    prefix = 27 + recovery_id + (4 if compressed else 0)
+    serialized_sig = prefix.to_bytes(1, byteorder='big') + r.to_bytes(32, byteorder='big') + s.to_bytes(32, byteorder='big')
+    return b64encode(serialized_sig).decode('ascii')
+
+
 def sign_message(private_key: int, plain_text: str) -> tuple:
     """Sign arbitrary message with bitcoin private key, returns (p2pkh_address, serialized_compact_signature)"""
     d = message_digest(plain_text)
@@ -25,46 +32,33 @@ def sign_message(private_key: int, plain_text: str) -> tuple:
     # p2pkh address
     public_key = scalar_multiply(private_key, curve.g)
     p2pkh_address = public_key_to_address(public_key, compressed=True)
-    # prefix = 27 + recovery_id + (4 if using compressed public key else 0)
-    prefix = 27 + recovery_id + 4
-    serialized_sig = prefix.to_bytes(1, byteorder='big') + r.to_bytes(32, byteorder='big') + s.to_bytes(32, byteorder='big')
-    return p2pkh_address, b64encode(serialized_sig).decode('ascii')
+    return p2pkh_address, serialize_compact_signature(recovery_id, r, s, compressed=True)
 
 
-def verify_message(p2pkh_address: str, plain_text: str, signature: str) -> bool:
-    """Verify serialized compact signature with p2pkh address and plain text"""
+def deserialize_compact_signature(signature: str) -> tuple:
+    """Deserialize base64 encoded (prefix || r || s) to (recovery_id, r, s, compressed), raises ValueError if malformed"""
     sig_bytes = b64decode(signature)
     if len(sig_bytes) != 65:
-        return False
+        raise ValueError(f'Compact signature should be 65 bytes, not {len(sig_bytes)}')
     prefix, r, s = sig_bytes[0], int.from_bytes(sig_bytes[1:33], byteorder='big'), int.from_bytes(sig_bytes[33:], byteorder='big')
-    # Calculate recovery_id
-    compressed = False
     if prefix < 27 or prefix >= 35:
+        raise ValueError(f'Invalid compact signature prefix {prefix}')
+    compressed = prefix >= 31
+    recovery_id = prefix - 27 - (4 if compressed else 0)
+    return recovery_id, r, s, compressed
+
+
+def verify_message(p2pkh_address: str, plain_text: str, signature: str) -> bool:
+    """Verify serialized compact signature with p2pkh address and plain text"""
+    try:
+        recovery_id, r, s, compressed = deserialize_compact_signature(signature)
+    except ValueError:
         return False
-    if prefix >= 31:
-        compressed = True
-        prefix -= 4
-    recovery_id = prefix - 27
-    # Recover point kG, k is the ephemeral private key
-    x = r + (curve.n if recovery_id >= 2 else 0)
-    y_squared = (x * x * x + curve.a * x + curve.b) % curve.p
-    y = pow(y_squared, (curve.p + 1) // 4, curve.p)
-    if (y + recovery_id) % 2 != 0:
-        y = -y % curve.p
-    point_k = (x, y)
-    # Calculate point aG, a is the private key
-    d = message_digest(plain_text)
-    e = hash_to_int(d)
-    mod_inv_r = modular_multiplicative_inverse(r, curve.n)
-    public_key = add(scalar_multiply(mod_inv_r * s, point_k), scalar_multiply(mod_inv_r * (-e % curve.n), curve.g))
-    # Verify signature
-    if not verify_signature(public_key, d, (r, s)):
-        return False
-    # Check public key hash
-    if public_key_hash(public_key, compressed) != address_to_public_key_hash(p2pkh_address):
+    # The recovered key is valid for the signature, only its hash is left to check
+    public_key = recover_public_key(message_digest(plain_text), (recovery_id, r, s))
+    if public_key is None:
         return False
-    # OK
-    return True
+    return public_key_hash(public_key, compressed) == address_to_public_key_hash(p2pkh_address)
 
 
 if __name__ == '__main__':
@@ -78,3 +72,5 @@ if __name__ == '__main__':
     address = public_key_to_address(pub_key, compressed=True)
     sig_electrum = 'IGdzMq98lowek10e3JFXWj909xp0oLRj71aF7jpWRxaabwH+fBia/K2JpoGQlFFbAl/Q5jo2DYSzQw6pZWhmRtk='
     print(verify_message(address, plain, sig_electrum))
+    recovery_id, r, s, _ = deserialize_compact_signature(sig_electrum)
+    assert recover_public_key(message_digest(plain), (recovery_id, r, s)) == pub_key
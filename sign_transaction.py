@@ -1,7 +1,9 @@
+import functools
+import hashlib
 from binascii import unhexlify, hexlify
 from collections import namedtuple
 
-from crypto import double_sha256
+from crypto import sha256, double_sha256
 from ec_point_operation import curve, scalar_multiply
 from meta import int_to_varint, address_to_public_key_hash, build_locking_script, deserialize_signature, serialize_signature, serialize_public_key
 from sign import verify_signature, sign
@@ -9,10 +11,16 @@ from sign import verify_signature, sign
 VERSION = 0x01.to_bytes(4, 'little')
 SEQUENCE = 0xffffffff.to_bytes(4, byteorder='little')
 LOCK_TIME = 0x00.to_bytes(4, byteorder='little')
+ZERO_HASH = bytes(32)
 
 SH_ALL = 0x01
+SH_NONE = 0x02
+SH_SINGLE = 0x03
 SH_FORKID = 0x40
+SH_ANYONECANPAY = 0x80
 SIGHASH_ALL = SH_ALL | SH_FORKID
+SIGHASH_NONE = SH_NONE | SH_FORKID
+SIGHASH_SINGLE = SH_SINGLE | SH_FORKID
 
 
 class TxIn:
@@ -27,7 +35,29 @@ class TxIn:
         self.sequence = sequence
 
 
-TxOut = namedtuple('TxOut', 'address satoshi')
+# Maximum number of addresses kept in the locking script cache
+LOCKING_SCRIPT_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=LOCKING_SCRIPT_CACHE_SIZE)
+def address_to_locking_script(address: str) -> bytes:
+    """Returns LEN(locking_script) || locking_script of the p2pkh address, cached by address with LRU eviction"""
+    return build_locking_script(address_to_public_key_hash(address))
+
+
+class TxOut(namedtuple('TxOut', 'address satoshi')):
+
+    @functools.cached_property
+    def locking_script(self) -> bytes:
+        """LEN(locking_script) || locking_script, computed on first access and kept by the output"""
+        return address_to_locking_script(self.address)
+
+
+def _output_parts(outputs: list):
+    """Yields satoshi, LEN(locking_script) || locking_script of every output"""
+    for output in outputs:
+        yield output.satoshi.to_bytes(8, byteorder='little')
+        yield output.locking_script
 
 
 def serialize_outputs(outputs: list) -> bytes:
@@ -35,59 +65,218 @@ def serialize_outputs(outputs: list) -> bytes:
     Serialize outputs [(address, satoshi), (address, satoshi), ...]
     to format (satoshi || LEN(locking_script) || locking_script) || (satoshi || LEN(locking_script) || locking_script) || ...)
     """
-    output_bytes = b''
-    for output in outputs:
-        output_bytes += output.satoshi.to_bytes(8, byteorder='little') + build_locking_script(address_to_public_key_hash(output.address))
-    return output_bytes
+    return b''.join(_output_parts(outputs))
+
+
+class SighashContext:
+    """
+    BIP-143 signature hash of the inputs of one unsigned transaction, built once and shared by all the inputs
+    hashPrevouts, hashSequence and hashOutputs are computed lazily and at most once, each input then hashes only its own fields
+    """
+
+    def __init__(self, tx_ins: list, tx_outs: list, lock_time: bytes = LOCK_TIME) -> None:
+        self.tx_ins = tx_ins
+        self.tx_outs = tx_outs
+        self.lock_time = lock_time
+        self._hash_prevouts = None
+        self._hash_sequence = None
+        self._hash_outputs = None
+        self._serialized_outputs = None
+        # (hashPrevouts, hashSequence) -> sha256 object which has consumed nVersion || hashPrevouts || hashSequence
+        self._prefixes = {}
+
+    @property
+    def hash_prevouts(self) -> bytes:
+        if self._hash_prevouts is None:
+            hasher = hashlib.sha256()
+            for tx_in in self.tx_ins:
+                hasher.update(tx_in.txid)
+                hasher.update(tx_in.index)
+            self._hash_prevouts = sha256(hasher.digest())
+        return self._hash_prevouts
+
+    @property
+    def hash_sequence(self) -> bytes:
+        if self._hash_sequence is None:
+            hasher = hashlib.sha256()
+            for tx_in in self.tx_ins:
+                hasher.update(tx_in.sequence)
+            self._hash_sequence = sha256(hasher.digest())
+        return self._hash_sequence
+
+    @property
+    def serialized_outputs(self) -> list:
+        """Returns [satoshi || LEN(locking_script) || locking_script, ...] of every output"""
+        if self._serialized_outputs is None:
+            self._serialized_outputs = [serialize_outputs([output]) for output in self.tx_outs]
+        return self._serialized_outputs
+
+    @property
+    def hash_outputs(self) -> bytes:
+        if self._hash_outputs is None:
+            hasher = hashlib.sha256()
+            for serialized in self.serialized_outputs:
+                hasher.update(serialized)
+            self._hash_outputs = sha256(hasher.digest())
+        return self._hash_outputs
+
+    @staticmethod
+    def _parse(sighash: int) -> tuple:
+        """Returns (anyone_can_pay, base_type) of the sighash flags, raises ValueError if not supported"""
+        base_type = sighash & 0x1f
+        if not sighash & SH_FORKID or base_type not in (SH_ALL, SH_NONE, SH_SINGLE) or sighash & ~(0x1f | SH_FORKID | SH_ANYONECANPAY):
+            raise ValueError(f'Unsupported SIGHASH value {sighash}')
+        return bool(sighash & SH_ANYONECANPAY), base_type
+
+    def _fields(self, index: int, sighash: int) -> list:
+        """Returns the fields of the preimage of the input"""
+        # BIP-143 https://github.com/bitcoin/bips/blob/master/bip-0143.mediawiki
+        #  1. nVersion of the transaction (4-byte little endian)
+        #  2. hashPrevouts (32-byte hash)
+        #  3. hashSequence (32-byte hash)
+        #  4. outpoint (32-byte hash + 4-byte little endian)
+        #  5. scriptCode of the input (serialized as scripts inside CTxOuts)
+        #  6. value of the output spent by this input (8-byte little endian)
+        #  7. nSequence of the input (4-byte little endian)
+        #  8. hashOutputs (32-byte hash)
+        #  9. nLocktime of the transaction (4-byte little endian)
+        # 10. sighash type of the signature (4-byte little endian)
+        anyone_can_pay, base_type = SighashContext._parse(sighash)
+        tx_in = self.tx_ins[index]
+        if base_type == SH_ALL:
+            hash_outputs = self.hash_outputs
+        elif base_type == SH_SINGLE and index < len(self.tx_outs):
+            # Only the output with the same index as this input
+            hash_outputs = double_sha256(self.serialized_outputs[index])
+        else:
+            hash_outputs = ZERO_HASH
+        return [
+            VERSION,
+            # ANYONECANPAY commits to this input only, NONE and SINGLE let the other inputs change their sequence
+            ZERO_HASH if anyone_can_pay else self.hash_prevouts,
+            ZERO_HASH if anyone_can_pay or base_type != SH_ALL else self.hash_sequence,
+            tx_in.txid, tx_in.index, tx_in.locking_script_len, tx_in.locking_script, tx_in.satoshi, tx_in.sequence,
+            hash_outputs,
+            self.lock_time,
+            sighash.to_bytes(4, byteorder='little'),
+        ]
+
+    def preimage(self, index: int, sighash: int = SIGHASH_ALL) -> bytes:
+        """Returns the BIP-143 preimage of the input, which is the message to sign"""
+        return b''.join(self._fields(index, sighash))
+
+    def midstate(self, index: int, sighash: int = SIGHASH_ALL) -> 'hashlib.sha256':
+        """Returns the sha256 object which has consumed the preimage of the input, finish with sha256(midstate.digest())"""
+        fields = self._fields(index, sighash)
+        # nVersion || hashPrevouts || hashSequence is the same for all the inputs signed with the same flags
+        key = (fields[1], fields[2])
+        if key not in self._prefixes:
+            self._prefixes[key] = hashlib.sha256(b''.join(fields[:3]))
+        hasher = self._prefixes[key].copy()
+        hasher.update(b''.join(fields[3:]))
+        return hasher
+
+    def digest(self, index: int, sighash: int = SIGHASH_ALL) -> bytes:
+        """Returns the signature hash of the input, double sha256 of its preimage"""
+        # The per-input part fits in a couple of sha256 blocks, hashing it whole is cheaper than copying a midstate
+        return double_sha256(self.preimage(index, sighash))
 
 
 def transaction_digest(tx_ins: list, tx_outs: list, lock_time: bytes = LOCK_TIME, sighash: int = SIGHASH_ALL) -> list:
     """Returns the digest of unsigned transaction according to SIGHASH"""
-    # BIP-143 https://github.com/bitcoin/bips/blob/master/bip-0143.mediawiki
-    #  1. nVersion of the transaction (4-byte little endian)
-    #  2. hashPrevouts (32-byte hash)
-    #  3. hashSequence (32-byte hash)
-    #  4. outpoint (32-byte hash + 4-byte little endian)
-    #  5. scriptCode of the input (serialized as scripts inside CTxOuts)
-    #  6. value of the output spent by this input (8-byte little endian)
-    #  7. nSequence of the input (4-byte little endian)
-    #  8. hashOutputs (32-byte hash)
-    #  9. nLocktime of the transaction (4-byte little endian)
-    # 10. sighash type of the signature (4-byte little endian)
-    if sighash == SIGHASH_ALL:
-        hash_prevouts = double_sha256(b''.join([tx_in.txid + tx_in.index for tx_in in tx_ins]))
-        hash_sequence = double_sha256(b''.join([tx_in.sequence for tx_in in tx_ins]))
-        hash_outputs = double_sha256(serialize_outputs(tx_outs))
-        digests = []
-        for tx_in in tx_ins:
-            digests.append(
-                VERSION +
-                hash_prevouts + hash_sequence +
-                tx_in.txid + tx_in.index + tx_in.locking_script_len + tx_in.locking_script + tx_in.satoshi + tx_in.sequence +
-                hash_outputs +
-                lock_time +
-                sighash.to_bytes(4, byteorder='little')
-            )
-        return digests
-    raise ValueError(f'Unsupported SIGHASH value {sighash}')
+    context = SighashContext(tx_ins, tx_outs, lock_time)
+    return [context.preimage(i, sighash) for i in range(len(tx_ins))]
 
 
-def serialize_transaction(tx_ins: list, tx_outs: list, lock_time: bytes = LOCK_TIME) -> bytes:
-    """Serialize signed transaction"""
+def _transaction_parts(tx_ins: list, tx_outs: list, lock_time: bytes = LOCK_TIME):
+    """Yields the fields of the signed transaction in serialization order"""
     # version
-    raw_transaction = VERSION
+    yield VERSION
     # inputs
-    raw_transaction += int_to_varint(len(tx_ins))
+    yield int_to_varint(len(tx_ins))
     for tx_in in tx_ins:
-        raw_transaction += tx_in.txid + tx_in.index + tx_in.unlocking_script_len + tx_in.unlocking_script + tx_in.sequence
+        yield tx_in.txid
+        yield tx_in.index
+        yield tx_in.unlocking_script_len
+        yield tx_in.unlocking_script
+        yield tx_in.sequence
     # outputs
-    raw_transaction += int_to_varint(len(tx_outs)) + serialize_outputs(tx_outs)
+    yield int_to_varint(len(tx_outs))
+    yield from _output_parts(tx_outs)
     # lock_time
-    raw_transaction += lock_time
-    return raw_transaction
+    yield lock_time
+
+
+# Bytes buffered before each write of write_transaction
+WRITE_CHUNK_SIZE = 1 << 16
+
+
+def transaction_size(tx_ins: list, tx_outs: list) -> int:
+    """Returns the exact size in bytes of the serialized signed transaction, without serializing it"""
+    size = len(VERSION) + len(int_to_varint(len(tx_ins))) + len(int_to_varint(len(tx_outs))) + len(LOCK_TIME)
+    for tx_in in tx_ins:
+        size += len(tx_in.txid) + len(tx_in.index) + len(tx_in.unlocking_script_len) + len(tx_in.unlocking_script) + len(tx_in.sequence)
+    for output in tx_outs:
+        # satoshi (8 bytes) || LEN(locking_script) || locking_script
+        size += 8 + len(output.locking_script)
+    return size
+
+
+def serialize_transaction(tx_ins: list, tx_outs: list, lock_time: bytes = LOCK_TIME) -> bytes:
+    """Serialize signed transaction"""
+    return b''.join(_transaction_parts(tx_ins, tx_outs, lock_time))
+
+
+def serialize_transaction_into(buffer, tx_ins: list, tx_outs: list, lock_time: bytes = LOCK_TIME, offset: int = 0) -> int:
+    """Serialize signed transaction into the writable buffer (bytearray, memoryview, mmap) from offset, returns the number of bytes written"""
+    view = memoryview(buffer)
+    start = offset
+    for part in _transaction_parts(tx_ins, tx_outs, lock_time):
+        end = offset + len(part)
+        if end > len(view):
+            raise ValueError(f'Buffer of {len(view)} bytes is too small for the transaction')
+        view[offset:end] = part
+        offset = end
+    return offset - start
+
+
+def serialize_transaction_view(tx_ins: list, tx_outs: list, lock_time: bytes = LOCK_TIME) -> memoryview:
+    """Serialize signed transaction into a buffer allocated once with the exact size, returns a view of the buffer"""
+    buffer = bytearray(transaction_size(tx_ins, tx_outs))
+    written = serialize_transaction_into(buffer, tx_ins, tx_outs, lock_time)
+    if written != len(buffer):
+        raise ValueError(f'Serialized {written} bytes into a buffer of {len(buffer)} bytes')
+    return memoryview(buffer)
+
+
+def _write_all(stream, data: bytes) -> None:
+    """Write all of data, raw streams such as open(path, 'wb', buffering=0) may write only part of it at a time"""
+    view = memoryview(data)
+    while view:
+        written = stream.write(view)
+        if written is None:
+            raise BlockingIOError(f'Stream would block with {len(view)} bytes left to write')
+        view = view[written:]
+
+
+def write_transaction(stream, tx_ins: list, tx_outs: list, lock_time: bytes = LOCK_TIME) -> int:
+    """Serialize signed transaction to the binary file-like stream in chunks, returns the number of bytes written"""
+    chunk = bytearray()
+    written = 0
+    for part in _transaction_parts(tx_ins, tx_outs, lock_time):
+        chunk += part
+        if len(chunk) >= WRITE_CHUNK_SIZE:
+            # Hand the stream a copy, the chunk is reused right after
+            _write_all(stream, bytes(chunk))
+            written += len(chunk)
+            chunk.clear()
+    _write_all(stream, bytes(chunk))
+    return written + len(chunk)
 
 
 if __name__ == '__main__':
+    import io
+
     priv_key = 0xf97c89aaacf0cd2e47ddbacc97dae1f88bec49106ac37716c451dcdd008a4b62
     pub_key = scalar_multiply(priv_key, curve.g)
     inputs = [
@@ -105,6 +294,13 @@ if __name__ == '__main__':
     serialized_sig = unhexlify('304402207e2c6eb8c4b20e251a71c580373a2836e209c50726e5f8b0f4f59f8af00eee1a022019ae1690e2eb4455add6ca5b86695d65d3261d914bc1d7abb40b188c7f46c9a5')
     sig = deserialize_signature(serialized_sig)
     print(verify_signature(pub_key, tx_digest, sig))
+    # Signature hashes of every input with all the supported flags, computed from the shared midstates
+    context = SighashContext(inputs, tx_outputs)
+    for flags in (SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE):
+        for sighash in (flags, flags | SH_ANYONECANPAY):
+            for i in range(len(inputs)):
+                assert context.digest(i, sighash) == sha256(context.midstate(i, sighash).digest())
+    assert SighashContext(tx_inputs, tx_outputs).preimage(0) == tx_digest
     #
     # Sign an unsigned transaction then broadcast
     # c04bbd007ad3987f9b2ea8534175b5e436e43d64471bf32139b5851adf9f477e
@@ -124,5 +320,21 @@ if __name__ == '__main__':
         print(hexlify(tx_inputs[i].unlocking_script_len))
     raw = serialize_transaction(tx_inputs, tx_outputs)
     print(hexlify(raw))
+    assert serialize_transaction_view(tx_inputs, tx_outputs) == raw and transaction_size(tx_inputs, tx_outputs) == len(raw)
+
+    # Raw stream accepting at most 100 bytes per write, as unbuffered files and sockets may
+    class ShortWriter(io.RawIOBase):
+        def __init__(self) -> None:
+            self.data = bytearray()
+
+        def writable(self) -> bool:
+            return True
+
+        def write(self, b) -> int:
+            self.data += b[:100]
+            return min(len(b), 100)
+
+    stream = ShortWriter()
+    assert write_transaction(stream, tx_inputs, tx_outputs) == len(raw) and stream.data == raw
     tx_id = double_sha256(raw)[::-1]
     print(hexlify(tx_id))
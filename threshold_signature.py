@@ -1,12 +1,29 @@
 import random
-from base64 import b64encode
+import secrets
+from collections import deque
+from concurrent.futures import Executor
+from itertools import repeat
 
-from ec_point_operation import curve, add, scalar_multiply
+import instrumentation
+from ec_point_operation import curve, add, scalar_multiply, multi_scalar_multiply, as_point, INFINITY
 from meta import public_key_to_address
-from modular_inverse import modular_multiplicative_inverse
+from modular_inverse import modular_multiplicative_inverse, batch_inverse
 from polynomial import Polynomial
+from presignature import Presignature, PresignaturePool
+from share_vector import ShareVector, as_share_vector
 from sign import hash_to_int
-from sign_message import message_digest, verify_message
+from sign_message import message_digest, verify_message, serialize_compact_signature
+
+
+def _deal(group_size: int, polynomial_order: int, debug: bool = False, verifiable: bool = False, seed: int = None) -> tuple:
+    """
+    Per-player work of jvrss, returns (polynomial, [f(1), f(2), ..., f(group_size)], commitments)
+    Commitments are [a0 * G, a1 * G, ..., at * G] if verifiable, else only the public contribution [a0 * G]
+    """
+    p = Polynomial.random(polynomial_order, debug, random.Random(seed) if seed is not None else None)
+    evaluations = p.evaluate_many(range(1, group_size + 1))
+    commitments = ThresholdSignature.commit(p) if verifiable else [scalar_multiply(p.coefficients[0], curve.g)]
+    return p, evaluations, commitments
 
 
 class ThresholdSignature:
@@ -14,16 +31,69 @@ class ThresholdSignature:
     @staticmethod
     def shares_to_points(shares: list) -> list:
         """Returns [(participant_id, share), (participant_id, share), ...]"""
-        return [(i + 1, shares[i]) for i in range(len(shares))]
+        return as_share_vector(shares).points()
 
     @staticmethod
     def inspect(items: list) -> str:
         return f'[{", ".join([str(item) for item in items])}]'
 
-    def __init__(self, group_size: int, threshold: int) -> None:
+    @staticmethod
+    def commit(polynomial: Polynomial) -> list:
+        """Returns Feldman commitments [a0 * G, a1 * G, ..., at * G] of the polynomial coefficients"""
+        return [scalar_multiply(coefficient, curve.g) for coefficient in polynomial.coefficients]
+
+    @staticmethod
+    def verify_shares(commitments: list, x: int, shares: list) -> bool:
+        """
+        Verify shares [f1(x), f2(x), ...] received by player x against commitments [[C10, C11, ...], [C20, C21, ...], ...] of the senders
+        Checks a random linear combination of fi(x) * G == sum(x^k * Cik) for all the senders in one multi scalar multiplication
+        """
+        terms = []
+        g_scalar = 0
+        for sender_commitments, share in zip(commitments, shares):
+            # Weights must be unpredictable, or a dealer can craft inconsistent shares which cancel out
+            rho = secrets.randbelow((1 << 128) - 1) + 1
+            g_scalar -= rho * share
+            coefficient = rho
+            for commitment in sender_commitments:
+                terms.append((coefficient, commitment))
+                coefficient = coefficient * x % curve.n
+        terms.append((g_scalar, curve.g))
+        return multi_scalar_multiply(terms) is INFINITY
+
+    @staticmethod
+    def verify_all_shares(commitments: list, received: list) -> bool:
+        """
+        Verify shares received [[f1(1), f2(1), ...], [f1(2), f2(2), ...], ...] by all the players against commitments of the senders
+        Checks one random linear combination over every sender i and receiver j with weight alpha_i * beta_j,
+        so commitment Cik gets the single scalar alpha_i * sum(beta_j * j^k) and all the checks cost one multi scalar multiplication
+        """
+        # Weights must be unpredictable, or dealers can craft inconsistent shares which cancel out
+        # alpha^T * E * beta of a nonzero matrix E of errors is zero only with probability about 2^-127
+        betas = [secrets.randbelow((1 << 128) - 1) + 1 for _ in received]
+        # power_sums[k] = sum(beta_j * j^k)
+        power_sums = []
+        powers = betas
+        for _ in range(max(len(sender_commitments) for sender_commitments in commitments)):
+            power_sums.append(sum(powers) % curve.n)
+            powers = [power * j % curve.n for j, power in enumerate(powers, 1)]
+        terms = []
+        g_scalar = 0
+        for i, sender_commitments in enumerate(commitments):
+            alpha = secrets.randbelow((1 << 128) - 1) + 1
+            g_scalar -= alpha * sum(beta * shares[i] for beta, shares in zip(betas, received))
+            terms.extend((alpha * power_sum, commitment) for power_sum, commitment in zip(power_sums, sender_commitments))
+        terms.append((g_scalar, curve.g))
+        return multi_scalar_multiply(terms) is INFINITY
+
+    def __init__(self, group_size: int, threshold: int, verifiable: bool = False, executor: Executor = None, shares: list = None, public_key: tuple = None) -> None:
         if group_size < 3:
             raise ValueError(f'Nakasendo group size should be 3 at least')
         self.group_size = group_size
+        # Publish coefficient commitments in jvrss and let every player verify the shares it receives
+        self.verifiable = verifiable
+        # Run the per-player work of jvrss, such as ProcessPoolExecutor, sequentially in this process if None
+        self.executor = executor
         # t
         self.polynomial_order = threshold - 1
         # t + 1
@@ -33,36 +103,85 @@ class ThresholdSignature:
         # Validate t >= 1 and t + 1 <= n and 2t + 1 <= n
         if self.polynomial_order < 1 or self.key_threshold > group_size or self.signature_threshold > group_size:
             raise ValueError(f'Nakasendo threshold should be in interval [2, {(group_size - 1) // 2 + 1}] with {group_size} players')
-        # Generate secret shares for each participant
-        self.shares, self.public_key = self.jvrss()
+        if shares is None:
+            # Generate secret shares for each participant
+            self.shares, self.public_key = self.jvrss()
+        else:
+            # Shares and public key of an existing group, such as loaded from a keystore
+            if len(shares) != group_size or public_key is None:
+                raise ValueError(f'Existing group should have {group_size} shares and a public key')
+            self.shares, self.public_key = as_share_vector(shares), as_point(public_key)
+        # Presignatures computed in advance, such as loaded from a keystore, used before any new one
+        self.presignatures = deque()
+        # Background pool of presignatures, see start_presigning
+        self.presignature_pool = None
 
+    def _deal_all(self, count: int, debug: bool = False) -> list:
+        """Returns dealings of every player for count secrets, [[dealing of player 1, dealing of player 2, ...], ...]"""
+        total = count * self.group_size
+        # Every player sends its shares of all the count secrets to the others in one round
+        instrumentation.count('round')
+        # Each player deals independently, farmed to the executor if there is one
+        if self.executor is None:
+            dealings = [_deal(self.group_size, self.polynomial_order, debug, self.verifiable) for _ in range(total)]
+        else:
+            # Seeds drawn here keep worker processes from sharing the random state they forked with
+            seeds = [random.getrandbits(128) for _ in range(total)]
+            dealings = list(self.executor.map(_deal, repeat(self.group_size), repeat(self.polynomial_order), repeat(debug), repeat(self.verifiable), seeds))
+        return [dealings[i:i + self.group_size] for i in range(0, total, self.group_size)]
+
+    @instrumentation.traced
     def jvrss(self, debug: bool = False) -> tuple:
         """Returns (shares_of_participants, group_shared_public_key)"""
         if debug:
             print('------------ jvrss ------------')
-        # Random polynomials for each player
-        polynomials = []
-        for i in range(self.group_size):
-            p = Polynomial.random(self.polynomial_order, debug)
-            if debug:
-                print(f'Player {i + 1} {p}')
-            polynomials.append(p)
+        return self._combine_dealings(self._deal_all(1, debug)[0], debug)
+
+    @instrumentation.traced
+    def jvrss_many(self, count: int) -> list:
+        """Returns [(shares_of_participants, group_shared_public_key), ...] of count secrets, dealt in one pass"""
+        return [self._combine_dealings(dealings) for dealings in self._deal_all(count)]
+
+    def _combine_dealings(self, dealings: list, debug: bool = False) -> tuple:
+        """Returns (shares_of_participants, group_shared_public_key) from the dealings of every player"""
+        polynomials = [dealing[0] for dealing in dealings]
+        if debug:
+            for i in range(self.group_size):
+                print(f'Player {i + 1} {polynomials[i]}')
         # Calculate shares for each player
         shares = [0] * self.group_size
+        received = [[0] * self.group_size for _ in range(self.group_size)]
         for i in range(self.group_size):
+            # All the shares player i deals
+            evaluations = dealings[i][1]
             for j in range(self.group_size):
-                fij = polynomials[i].evaluate(j + 1)
+                fij = evaluations[j]
                 shares[j] += fij
+                received[j][i] = fij
                 if debug:
                     print(f'f{i + 1}({j + 1}) = {fij}', end='\t')
             if debug:
                 print()
         for i in range(len(shares)):
             shares[i] %= curve.n
+        shares = ShareVector(shares)
         # Calculate group shared public key
-        public_key = None
+        public_key = INFINITY
+        commitments = [dealing[2] for dealing in dealings]
+        # Every player publishes its commitments, the simulator verifies the shares of all the receivers at once
+        if self.verifiable and not ThresholdSignature.verify_all_shares(commitments, received):
+            # Find the player who received inconsistent shares, every player verifies its own
+            receiver_ids = range(1, self.group_size + 1)
+            if self.executor is None:
+                verified = [ThresholdSignature.verify_shares(commitments, j, received[j - 1]) for j in receiver_ids]
+            else:
+                verified = list(self.executor.map(ThresholdSignature.verify_shares, repeat(commitments), receiver_ids, received))
+            for j in receiver_ids:
+                if not verified[j - 1]:
+                    raise ValueError(f'Player {j} received shares inconsistent with the commitments')
+            raise ValueError('Shares inconsistent with the commitments')
         for i in range(self.group_size):
-            public_key = add(public_key, scalar_multiply(polynomials[i].coefficients[0], curve.g))
+            public_key = add(public_key, commitments[i][0])
         if debug:
             secret = sum([p.coefficients[0] for p in polynomials]) % curve.n
             mod_inv_secret = modular_multiplicative_inverse(secret, curve.n)
@@ -73,6 +192,7 @@ class ThresholdSignature:
             print('-------------------------------')
         return shares, public_key
 
+    @instrumentation.traced
     def addss(self, a_shares: list, b_shares: list, debug: bool = False) -> int:
         """Returns secret addition of a and b, with a shares and b shares, without knowing a and b"""
         assert len(a_shares) == self.group_size
@@ -81,17 +201,19 @@ class ThresholdSignature:
             print('------------ addss ------------')
             print(ThresholdSignature.inspect(a_shares))
             print(ThresholdSignature.inspect(b_shares))
-        shares_addition = [(a_shares[i] + b_shares[i]) % curve.n for i in range(self.group_size)]
+        instrumentation.count('round')
+        shares_addition = as_share_vector(a_shares).add(b_shares)
         # random pick (t + 1) points
-        random_points = random.sample(ThresholdSignature.shares_to_points(shares_addition), self.polynomial_order + 1)
-        secrets_addition = Polynomial.interpolate_evaluate(random_points, 0)
+        picked_ids = shares_addition.sample_ids(self.polynomial_order + 1)
+        secrets_addition = shares_addition.interpolate(picked_ids, 0)
         if debug:
             print(f'shares addition = {ThresholdSignature.inspect(shares_addition)}')
-            print(f'points picked = {ThresholdSignature.inspect(random_points)}')
+            print(f'points picked = {ThresholdSignature.inspect([(i, shares_addition.share_of(i)) for i in picked_ids])}')
             print(f'secrets addition = {secrets_addition}')
             print('-------------------------------')
         return secrets_addition
 
+    @instrumentation.traced
     def pross(self, a_shares: list, b_shares: list, debug: bool = False) -> int:
         """Returns secret product of a and b, with a shares and b shares, without knowing a and b"""
         assert len(a_shares) == self.group_size
@@ -100,17 +222,19 @@ class ThresholdSignature:
             print('------------ pross ------------')
             print(ThresholdSignature.inspect(a_shares))
             print(ThresholdSignature.inspect(b_shares))
-        shares_product = [(a_shares[i] * b_shares[i]) % curve.n for i in range(self.group_size)]
+        instrumentation.count('round')
+        shares_product = as_share_vector(a_shares).multiply(b_shares)
         # random pick (2t + 1) points
-        random_points = random.sample(ThresholdSignature.shares_to_points(shares_product), 2 * self.polynomial_order + 1)
-        secrets_product = Polynomial.interpolate_evaluate(random_points, 0)
+        picked_ids = shares_product.sample_ids(2 * self.polynomial_order + 1)
+        secrets_product = shares_product.interpolate(picked_ids, 0)
         if debug:
             print(f'shares product = {ThresholdSignature.inspect(shares_product)}')
-            print(f'points picked = {ThresholdSignature.inspect(random_points)}')
+            print(f'points picked = {ThresholdSignature.inspect([(i, shares_product.share_of(i)) for i in picked_ids])}')
             print(f'secrets product = {secrets_product}')
             print('-------------------------------')
         return secrets_product
 
+    @instrumentation.traced
     def invss(self, a_shares: list, debug: bool = False) -> list:
         """Returns shares of modular multiplicative inverse of a, with shares of a, without knowing a"""
         assert len(a_shares) == self.group_size
@@ -120,54 +244,128 @@ class ThresholdSignature:
         b, _ = self.jvrss(debug)
         u = self.pross(a_shares, b, debug)
         mod_inv_u = modular_multiplicative_inverse(u, curve.n)
-        inverse_shares = [(mod_inv_u * bi) % curve.n for bi in b]
+        inverse_shares = b.scale(mod_inv_u)
         if debug:
             print(f'u = {u}')
             print(f'mod_inv_u = {mod_inv_u}')
             print(f'inverse shares = {ThresholdSignature.inspect(inverse_shares)}')
-            random_points = random.sample(ThresholdSignature.shares_to_points(inverse_shares), 2 * self.polynomial_order + 1)
-            print(f'points picked = {ThresholdSignature.inspect(random_points)}')
-            secret_inverse = Polynomial.interpolate_evaluate(random_points, 0)
+            picked_ids = inverse_shares.sample_ids(2 * self.polynomial_order + 1)
+            print(f'points picked = {ThresholdSignature.inspect([(i, inverse_shares.share_of(i)) for i in picked_ids])}')
+            secret_inverse = inverse_shares.interpolate(picked_ids, 0)
             print(f'inverse secret = {secret_inverse}')
             print('-------------------------------')
         return inverse_shares
 
+    @instrumentation.traced
+    def invss_many(self, a_shares_list: list) -> list:
+        """Returns shares of modular multiplicative inverses of many secrets, with one jvrss pass, one batched pross and one inversion"""
+        count = len(a_shares_list)
+        b_list = [b for b, _ in self.jvrss_many(count)]
+        # pross of all the pairs, interpolated with the same picked participants
+        picked_ids = random.sample(range(1, self.group_size + 1), self.signature_threshold)
+        instrumentation.count('round')
+        u_list = [as_share_vector(a_shares).multiply(b).interpolate(picked_ids, 0) for a_shares, b in zip(a_shares_list, b_list)]
+        mod_inv_u_list = batch_inverse(u_list, curve.n)
+        return [b.scale(mod_inv_u) for b, mod_inv_u in zip(b_list, mod_inv_u_list)]
+
+    @instrumentation.traced
     def restore_key(self, points: list) -> int:
         """Restore key from given points [(participant_id, share), ...]"""
         if len(points) < self.key_threshold:
             raise ValueError(f'The number of points is less than the threshold')
         return Polynomial.interpolate_evaluate(points, 0)
 
+    def presign(self) -> Presignature:
+        """Returns the message independent part of a signature, a presignature should be used for only one signature"""
+        return self.presign_many(1)[0]
+
+    @instrumentation.traced
+    def presign_many(self, count: int) -> list:
+        """Returns count presignatures, nonces of which are dealt in one jvrss pass and inverted with one batched invss"""
+        nonces = []
+        while len(nonces) < count:
+            for k_shares, k_public_key in self.jvrss_many(count - len(nonces)):
+                # r = 0 is discarded and dealt again
+                if k_public_key.x % curve.n:
+                    nonces.append((k_shares, k_public_key))
+                else:
+                    instrumentation.count('nonce_retry')
+        mod_inv_k_shares_list = self.invss_many([k_shares for k_shares, _ in nonces])
+        presignatures = []
+        for (_, (k_x, k_y)), mod_inv_k_shares in zip(nonces, mod_inv_k_shares_list):
+            r = k_x % curve.n
+            recovery_id = 0 | 2 if k_x > curve.n else 0 | k_y % 2
+            # Pick participants to interpolate s and warm up the Lagrange coefficients cache
+            ids = mod_inv_k_shares.sample_ids(self.signature_threshold)
+            Polynomial.lagrange_coefficients(ids, 0)
+            presignatures.append(Presignature(r, recovery_id, mod_inv_k_shares, ids))
+        return presignatures
+
+    def start_presigning(self, target_size: int = 16, low_water_mark: int = 4) -> PresignaturePool:
+        """Start a background worker keeping a pool of presignatures, signing then only runs the message dependent step"""
+        self.stop_presigning()
+        self.presignature_pool = PresignaturePool(self.presign, target_size, low_water_mark)
+        return self.presignature_pool
+
+    def stop_presigning(self) -> None:
+        """Stop the presignature worker, signing runs the full protocol again"""
+        if self.presignature_pool is not None:
+            self.presignature_pool.stop()
+            self.presignature_pool = None
+
+    def _take_presignatures(self, count: int) -> list:
+        """Returns count presignatures, stored ones first, then those the pool holds if presigning is started, the rest computed in one batch"""
+        presignatures = []
+        while self.presignatures and len(presignatures) < count:
+            presignatures.append(self.presignatures.popleft())
+        if len(presignatures) < count and self.presignature_pool is not None:
+            presignatures += self.presignature_pool.take_up_to(count - len(presignatures))
+        if len(presignatures) < count:
+            presignatures += self.presign_many(count - len(presignatures))
+        return presignatures
+
+    def _sign_with(self, e: int, presignature: Presignature) -> int:
+        """Returns s = (e + r * x) * k^-1, interpolated from the shares of s of the participants picked by the presignature"""
+        r, mod_inv_k_shares = presignature.r, presignature.mod_inv_k_shares
+        # Every picked participant publishes its share of s
+        instrumentation.count('round')
+        instrumentation.count('interpolation')
+        coefficients = Polynomial.lagrange_coefficients(presignature.ids, 0)
+        s = 0
+        for participant_id in presignature.ids:
+            s_share = (e + r * self.shares.share_of(participant_id)) * mod_inv_k_shares.share_of(participant_id)
+            s += coefficients[participant_id] * s_share
+        return s % curve.n
+
     def sign_recoverable(self, message: bytes) -> tuple:
         """Create ECDSA compact signature (recovery_id, r, s) with private key shares"""
-        e = hash_to_int(message)
-        recovery_id, r, s = 0, 0, 0
-        while not s:
-            mod_inv_k_shares = []
-            # Calculate final r
-            while not r:
-                k_shares, k_public_key = self.jvrss()
-                k_x, k_y = k_public_key
-                r = k_x % curve.n
-                recovery_id = 0 | 2 if k_x > curve.n else 0 | k_y % 2
-                mod_inv_k_shares = self.invss(k_shares)
-            # Calculate shares of s for each participant
-            s_shares = []
-            for i in range(self.group_size):
-                s_shares.append(((e + r * self.shares[i]) * mod_inv_k_shares[i]) % curve.n)
-            # Interpolate shares of s to get final s
-            s = Polynomial.interpolate_evaluate(random.sample(ThresholdSignature.shares_to_points(s_shares), self.signature_threshold), 0)
-        return recovery_id, r, s
+        return self.sign_recoverable_many([message])[0]
+
+    @instrumentation.traced
+    def sign_recoverable_many(self, messages: list) -> list:
+        """Create ECDSA compact signatures [(recovery_id, r, s), ...] of all the messages, with nonces prepared in one batch"""
+        signatures = []
+        for message, presignature in zip(messages, self._take_presignatures(len(messages))):
+            e = hash_to_int(message)
+            s = self._sign_with(e, presignature)
+            while not s:
+                # s = 0, sign again with another nonce
+                instrumentation.count('nonce_retry')
+                presignature = self._take_presignatures(1)[0]
+                s = self._sign_with(e, presignature)
+            signatures.append((presignature.recovery_id, presignature.r, s))
+        return signatures
 
     def sign_message(self, plain_text: str) -> tuple:
         """Sign arbitrary message with private key shares, returns (p2pkh_address, serialized_compact_signature)"""
-        d = message_digest(plain_text)
-        # recovery signature
-        recovery_id, r, s = self.sign_recoverable(d)
-        # prefix = 27 + recovery_id + (4 if using compressed public key else 0)
-        prefix = 27 + recovery_id + 4
-        serialized_sig = prefix.to_bytes(1, byteorder='big') + r.to_bytes(32, byteorder='big') + s.to_bytes(32, byteorder='big')
-        return public_key_to_address(self.public_key, compressed=True), b64encode(serialized_sig).decode('ascii')
+        return self.sign_messages([plain_text])[0]
+
+    @instrumentation.traced
+    def sign_messages(self, plain_texts: list) -> list:
+        """Sign arbitrary messages with private key shares in one batch, returns [(p2pkh_address, serialized_compact_signature), ...]"""
+        signatures = self.sign_recoverable_many([message_digest(plain_text) for plain_text in plain_texts])
+        address = public_key_to_address(self.public_key, compressed=True)
+        return [(address, serialize_compact_signature(recovery_id, r, s, compressed=True)) for recovery_id, r, s in signatures]
 
 
 if __name__ == '__main__':
@@ -182,3 +380,29 @@ if __name__ == '__main__':
     print('------------------')
     # Verify signature
     print(verify_message(address, plain, sig))
+    print('------------------')
+    # Sign message with presignatures computed in advance
+    import time
+
+    ts.start_presigning(target_size=8, low_water_mark=2)
+    ts.presignature_pool.wait_filled()
+    start = time.perf_counter()
+    address, sig = ts.sign_message(plain)
+    print(f'{(time.perf_counter() - start) * 1000:.3f} ms', address, sig)
+    print(verify_message(address, plain, sig))
+    # A batch larger than the pool takes what the pool holds and presigns the rest together
+    texts = [f'Pooled {i}' for i in range(20)]
+    signed = ts.sign_messages(texts)
+    assert all(verify_message(address, text, sig) for text, (address, sig) in zip(texts, signed))
+    ts.stop_presigning()
+    print('------------------')
+    # Sign messages in one batch
+    texts = [f'Attestation {i}' for i in range(20)]
+    ts_batch = ThresholdSignature(group_size=5, threshold=2)
+    start = time.perf_counter()
+    signed = ts_batch.sign_messages(texts)
+    print(f'sign_messages {(time.perf_counter() - start) * 1000 / len(texts):.3f} ms/message')
+    assert all(verify_message(address, text, sig) for text, (address, sig) in zip(texts, signed))
+    start = time.perf_counter()
+    signed = [ts_batch.sign_message(text) for text in texts]
+    print(f'sign_message  {(time.perf_counter() - start) * 1000 / len(texts):.3f} ms/message')
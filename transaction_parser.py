@@ -0,0 +1,257 @@
+from collections.abc import Sequence
+
+from crypto import double_sha256
+from meta import varint_to_int, locking_script_to_public_key_hash, public_key_hash_to_address
+from sign_transaction import TxIn, TxOut
+
+
+def _check_bounds(view: memoryview, end: int) -> None:
+    if end > len(view):
+        raise ValueError(f'Truncated transaction, {end} bytes required but only {len(view)} available')
+
+
+class RawTxIn:
+    """Input of a raw transaction, fields are read from the underlying buffer when accessed"""
+
+    __slots__ = ('_view', '_offset', '_script_offset', '_script_end')
+
+    def __init__(self, view: memoryview, offset: int, script_offset: int, script_end: int) -> None:
+        self._view = view
+        self._offset = offset
+        self._script_offset = script_offset
+        self._script_end = script_end
+
+    @property
+    def txid(self) -> str:
+        """Hex txid of the previous transaction, in the usual display (big-endian) order"""
+        return bytes(self._view[self._offset:self._offset + 32])[::-1].hex()
+
+    @property
+    def index(self) -> int:
+        return int.from_bytes(self._view[self._offset + 32:self._offset + 36], byteorder='little')
+
+    @property
+    def unlocking_script(self) -> memoryview:
+        """View of the unlocking script, not copied"""
+        return self._view[self._script_offset:self._script_end]
+
+    @property
+    def sequence(self) -> bytes:
+        return bytes(self._view[self._script_end:self._script_end + 4])
+
+    def to_tx_in(self, satoshi: int = 0, locking_script: str = '') -> TxIn:
+        """Returns a TxIn, satoshi and locking_script of the spent output are not part of the raw transaction"""
+        tx_in = TxIn(satoshi, self.txid, self.index, locking_script, self.sequence)
+        tx_in.unlocking_script = bytes(self.unlocking_script)
+        tx_in.unlocking_script_len = bytes(self._view[self._offset + 36:self._script_offset])
+        return tx_in
+
+
+class RawTxOut:
+    """Output of a raw transaction, fields are read from the underlying buffer when accessed"""
+
+    __slots__ = ('_view', '_offset', '_script_offset', '_script_end')
+
+    def __init__(self, view: memoryview, offset: int, script_offset: int, script_end: int) -> None:
+        self._view = view
+        self._offset = offset
+        self._script_offset = script_offset
+        self._script_end = script_end
+
+    @property
+    def satoshi(self) -> int:
+        return int.from_bytes(self._view[self._offset:self._offset + 8], byteorder='little')
+
+    @property
+    def locking_script(self) -> memoryview:
+        """View of the locking script, not copied"""
+        return self._view[self._script_offset:self._script_end]
+
+    @property
+    def address(self) -> str:
+        """P2pkh address of the output, raises ValueError for other locking scripts"""
+        return public_key_hash_to_address(locking_script_to_public_key_hash(self.locking_script))
+
+    def to_tx_out(self) -> TxOut:
+        """Returns a TxOut, only p2pkh outputs can be represented"""
+        return TxOut(address=self.address, satoshi=self.satoshi)
+
+
+class _LazyFields(Sequence):
+    """Read-only sequence creating an input or output object only when the item is accessed"""
+
+    def __init__(self, view: memoryview, offsets: list, factory) -> None:
+        self._view = view
+        # [(offset, script_offset, script_end), ...]
+        self._offsets = offsets
+        self._factory = factory
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self._factory(self._view, *self._offsets[i])
+
+
+class RawTransaction:
+    """
+    Transaction parsed lazily over a buffer (bytes, bytearray, memoryview, mmap) without copying it
+    Only the positions of the inputs and outputs are scanned, and only when first needed, scripts stay views of the buffer
+    """
+
+    def __init__(self, buffer, offset: int = 0) -> None:
+        self._view = memoryview(buffer).cast('B')
+        self.offset = offset
+        self._inputs = None
+        self._outputs = None
+        self._end = None
+        self._txid = None
+
+    def _scan(self) -> None:
+        """Find the positions of all the inputs and outputs, and the end of the transaction"""
+        view = self._view
+        offset = self.offset + 4
+        _check_bounds(view, offset)
+        count, offset = varint_to_int(view, offset)
+        inputs = []
+        for _ in range(count):
+            # txid (32 bytes) || index (4 bytes) || LEN(unlocking_script) || unlocking_script || sequence (4 bytes)
+            script_length, script_offset = varint_to_int(view, offset + 36)
+            script_end = script_offset + script_length
+            _check_bounds(view, script_end + 4)
+            inputs.append((offset, script_offset, script_end))
+            offset = script_end + 4
+        count, offset = varint_to_int(view, offset)
+        outputs = []
+        for _ in range(count):
+            # satoshi (8 bytes) || LEN(locking_script) || locking_script
+            script_length, script_offset = varint_to_int(view, offset + 8)
+            script_end = script_offset + script_length
+            _check_bounds(view, script_end)
+            outputs.append((offset, script_offset, script_end))
+            offset = script_end
+        _check_bounds(view, offset + 4)
+        self._inputs = _LazyFields(view, inputs, RawTxIn)
+        self._outputs = _LazyFields(view, outputs, RawTxOut)
+        self._end = offset + 4
+
+    @property
+    def version(self) -> int:
+        _check_bounds(self._view, self.offset + 4)
+        return int.from_bytes(self._view[self.offset:self.offset + 4], byteorder='little')
+
+    @property
+    def inputs(self) -> Sequence:
+        if self._inputs is None:
+            self._scan()
+        return self._inputs
+
+    @property
+    def outputs(self) -> Sequence:
+        if self._outputs is None:
+            self._scan()
+        return self._outputs
+
+    @property
+    def end(self) -> int:
+        """Offset right after the transaction in the buffer, where the next concatenated transaction starts"""
+        if self._end is None:
+            self._scan()
+        return self._end
+
+    @property
+    def size(self) -> int:
+        return self.end - self.offset
+
+    @property
+    def raw(self) -> memoryview:
+        """View of the serialized transaction, not copied"""
+        return self._view[self.offset:self.end]
+
+    @property
+    def lock_time(self) -> bytes:
+        return bytes(self._view[self.end - 4:self.end])
+
+    @property
+    def txid(self) -> str:
+        if self._txid is None:
+            self._txid = double_sha256(self.raw)[::-1].hex()
+        return self._txid
+
+    def to_tx(self, prevouts: list = None) -> tuple:
+        """
+        Returns (tx_ins, tx_outs, lock_time) for serialize_transaction and transaction_digest
+        prevouts [(satoshi, locking_script), ...] of the spent outputs are needed to compute digests, not to serialize
+        Round trips through serialize_transaction for version 1 transactions with p2pkh outputs, which is what this project builds
+        """
+        prevouts = prevouts or [(0, '')] * len(self.inputs)
+        if len(prevouts) != len(self.inputs):
+            raise ValueError(f'{len(prevouts)} prevouts do not match {len(self.inputs)} inputs')
+        tx_ins = [tx_in.to_tx_in(satoshi, locking_script) for tx_in, (satoshi, locking_script) in zip(self.inputs, prevouts)]
+        tx_outs = [tx_out.to_tx_out() for tx_out in self.outputs]
+        return tx_ins, tx_outs, self.lock_time
+
+
+def parse_transaction(buffer, offset: int = 0) -> RawTransaction:
+    """Returns the transaction serialized in buffer at offset, parsed lazily"""
+    return RawTransaction(buffer, offset)
+
+
+def iter_transactions(buffer, offset: int = 0):
+    """Yields every transaction of concatenated serialized transactions in buffer, such as an mmap of a file"""
+    length = len(memoryview(buffer).cast('B'))
+    while offset < length:
+        transaction = RawTransaction(buffer, offset)
+        yield transaction
+        offset = transaction.end
+
+
+if __name__ == '__main__':
+    import mmap
+    import tempfile
+
+    from ec_point_operation import curve, scalar_multiply
+    from meta import int_to_varint, serialize_public_key, serialize_signature
+    from sign import sign
+    from sign_transaction import SIGHASH_ALL, transaction_digest, serialize_transaction
+
+    priv_key = 0xf97c89aaacf0cd2e47ddbacc97dae1f88bec49106ac37716c451dcdd008a4b62
+    serialized_pub_key = serialize_public_key(scalar_multiply(priv_key, curve.g))
+    inputs = [
+        TxIn(satoshi=1000, txid='d2bc57099dd434a5adb51f7de38cc9b8565fb208090d9b5ea7a6b4778e1fdd48', index=2, locking_script='76a9146a176cd51593e00542b8e1958b7da2be97452d0588ac'),
+        TxIn(satoshi=1000, txid='fcc1a53e8bb01dbc094e86cb86f195219022c26e0c03d6f18ea17c3a3ba3c1e4', index=0, locking_script='76a9146a176cd51593e00542b8e1958b7da2be97452d0588ac'),
+    ]
+    outputs = [TxOut(address='18CgRLx9hFZqDZv75J5kED7ANnDriwvpi1', satoshi=1700)]
+    for tx_in, tx_digest in zip(inputs, transaction_digest(inputs, outputs)):
+        serialized_sig = serialize_signature(sign(priv_key, tx_digest))
+        tx_in.unlocking_script = bytes([len(serialized_sig) + 1]) + serialized_sig + bytes([SIGHASH_ALL, len(serialized_pub_key)]) + serialized_pub_key
+        tx_in.unlocking_script_len = int_to_varint(len(tx_in.unlocking_script))
+    raw = serialize_transaction(inputs, outputs)
+    tx = parse_transaction(raw)
+    print(tx.txid, tx.size, len(tx.inputs), len(tx.outputs))
+    for tx_in in tx.inputs:
+        print(tx_in.txid, tx_in.index, tx_in.sequence.hex())
+    for tx_out in tx.outputs:
+        print(tx_out.address, tx_out.satoshi)
+    tx_ins, tx_outs, lock_time = tx.to_tx([(1000, '76a9146a176cd51593e00542b8e1958b7da2be97452d0588ac')] * 2)
+    assert serialize_transaction(tx_ins, tx_outs, lock_time) == raw
+    assert transaction_digest(tx_ins, tx_outs) == transaction_digest(inputs, outputs)
+    try:
+        tx.to_tx([(1000, '76a9146a176cd51593e00542b8e1958b7da2be97452d0588ac')])
+        assert False, 'missing prevout accepted'
+    except ValueError as e:
+        print(e)
+    # Concatenated transactions in a file, parsed over mmap
+    with tempfile.TemporaryFile() as f:
+        f.write(raw * 1000)
+        f.flush()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            count = 0
+            for tx in iter_transactions(mapped):
+                assert tx.outputs[0].satoshi == 1700
+                count += 1
+            # Release every view of the map before it is closed
+            del tx
+            print(count, 'transactions')